@@ -4,28 +4,70 @@
 
 ######
 import argparse
+import collections
+import select
 import socket
 import os
 import sys
 import struct
 import time
 
+import floodPing
+import hostResolver
+import icmpChecksum
+import icmpDecoder
+import icmpSession
+import multiPing
+import pathMTU
+import pcapReader
+import pcapReplay
+import pcapWriter
+import probeScheduler
+import probeWindow
+import rttStatistics
+import targetRange
+
+MAX_HOPS = 30
+
+# what ping keeps per address family of the host it probes
+PingStream = collections.namedtuple('PingStream', 'session address window statistics')
+
 
 def setupArgumentParser() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description='A collection of Network Applications developed for SCC.203.')
-    parser.set_defaults(func=ICMPPing, hostname='lancaster.ac.uk')
+    parser.set_defaults(func=ICMPPing, hostname='lancaster.ac.uk', count=None, timeout=None, unprivileged=False,
+                        family=None, file=None, interval=1.0, deadline=None, flood=False, rate=None, pcap=None)
     subparsers = parser.add_subparsers(help='sub-command help')
 
     parser_p = subparsers.add_parser(
         'ping', aliases=['p'], help='run ping')
-    parser_p.add_argument('hostname', type=str,
-                          help='host to ping towards')
+    parser_p.add_argument('hostname', type=str, nargs='?',
+                          help='host to ping towards, or a range to sweep (10.0.0.0/16, 10.0.0.1-10.0.0.200)')
     parser_p.add_argument('count', nargs='?', type=int,
                           help='number of times to ping the host before stopping')
     parser_p.add_argument('timeout', nargs='?',
                           type=int,
                           help='maximum timeout before considering request lost')
+    parser_p.add_argument('-i', '--interval', type=float, default=1.0,
+                          help='seconds between probes, fractions down to well below a millisecond are fine')
+    parser_p.add_argument('-w', '--deadline', type=float,
+                          help='stop after this many seconds whatever the count')
+    parser_p.add_argument('-u', '--unprivileged', action='store_true',
+                          help='use a datagram ICMP socket instead of a raw one (Linux, no root needed)')
+    parser_p.add_argument('-4', dest='family', action='store_const', const=socket.AF_INET,
+                          help='only ping the IPv4 address of a dual-stack host')
+    parser_p.add_argument('-6', dest='family', action='store_const', const=socket.AF_INET6,
+                          help='only ping the IPv6 address of a dual-stack host')
+    parser_p.add_argument('-f', '--file', type=str,
+                          help='also ping every host listed in this file (one per line, - for stdin) at once')
+    parser_p.add_argument('--flood', action='store_true',
+                          help='send as fast as possible, in batches, with a live rate and loss readout')
+    parser_p.add_argument('--rate', type=float,
+                          help='probes per second: like --flood but paced, also caps sweeps of ranges '
+                               '(%d by default, 0 for none) and files' % (targetRange.SWEEP_RATE))
+    parser_p.add_argument('--pcap', type=str, metavar='FILE',
+                          help='write every probe sent and packet received to FILE in pcap format')
     parser_p.set_defaults(func=ICMPPing)
 
     parser_t = subparsers.add_parser('traceroute', aliases=['t'],
@@ -36,8 +78,40 @@ def setupArgumentParser() -> argparse.Namespace:
                           help='maximum timeout before considering request lost')
     parser_t.add_argument('protocol', nargs='?', type=str,
                           help='protocol to send request with (UDP/ICMP)')
+    parser_t.add_argument('-u', '--unprivileged', action='store_true',
+                          help='use a datagram ICMP socket instead of a raw one (Linux, no root needed)')
+    parser_t.add_argument('-4', dest='family', action='store_const', const=socket.AF_INET,
+                          help='trace over IPv4')
+    parser_t.add_argument('-6', dest='family', action='store_const', const=socket.AF_INET6,
+                          help='trace over IPv6')
+    parser_t.add_argument('-m', '--max-hops', type=int, default=MAX_HOPS,
+                          help='largest TTL to probe with')
+    parser_t.add_argument('-p', '--parallel', action='store_true',
+                          help='send the probes for every TTL at once, the path comes back in about one timeout')
+    parser_t.add_argument('--pcap', type=str, metavar='FILE',
+                          help='write every probe sent and packet received to FILE in pcap format')
     parser_t.set_defaults(func=Traceroute)
 
+    parser_m = subparsers.add_parser('pmtu', aliases=['m'],
+                                     help='find the path MTU to one or more hosts')
+    parser_m.add_argument('hostnames', type=str, nargs='+', metavar='hostname',
+                          help='hosts to find the path MTU towards, all searched at once')
+    parser_m.add_argument('-t', '--timeout', type=float,
+                          help='seconds to wait for the replies of each round of probes')
+    parser_m.add_argument('-p', '--parallel', type=int, default=pathMTU.PARALLEL_PROBES,
+                          help='probe sizes sent at once per host and round')
+    parser_m.add_argument('-u', '--unprivileged', action='store_true',
+                          help='use a datagram ICMP socket instead of a raw one (Linux, no root needed)')
+    parser_m.set_defaults(func=PathMTU)
+
+    parser_r = subparsers.add_parser('replay', aliases=['r'],
+                                     help='rebuild ping and traceroute statistics from a pcap file')
+    parser_r.add_argument('capture', type=str, metavar='FILE',
+                          help='pcap file to replay, as written by --pcap or tcpdump')
+    parser_r.add_argument('-t', '--timeout', type=float,
+                          help='seconds of capture time after which an unanswered probe counts as lost')
+    parser_r.set_defaults(func=Replay)
+
     parser_w = subparsers.add_parser(
         'web', aliases=['w'], help='run web server')
     parser_w.set_defaults(port=8080)
@@ -53,33 +127,61 @@ def setupArgumentParser() -> argparse.Namespace:
     parser_x.set_defaults(func=Proxy)
 
     args = parser.parse_args()
+    # ping takes its targets from the hostname or from -f, one of them has to be there
+    if args.func is ICMPPing and args.hostname is None and not args.file:
+        parser_p.error('a hostname or -f/--file is required')
     return args
 
 
 class NetworkApplication:
 
+    capture = None
+
     def checksum(self, dataToChecksum: str) -> str:
-        csum = 0
-        countTo = (len(dataToChecksum) // 2) * 2
-        count = 0
-
-        while count < countTo:
-            thisVal = dataToChecksum[count+1] * 256 + dataToChecksum[count]
-            csum = csum + thisVal
-            csum = csum & 0xffffffff
-            count = count + 2
-
-        if countTo < len(dataToChecksum):
-            csum = csum + dataToChecksum[len(dataToChecksum) - 1]
-            csum = csum & 0xffffffff
-
-        csum = (csum >> 16) + (csum & 0xffff)
-        csum = csum + (csum >> 16)
-        answer = ~csum
-        answer = answer & 0xffff
-        answer = answer >> 8 | (answer << 8 & 0xff00)
-        answer = socket.htons(answer)
-        return answer
+        # Bulk version in icmpChecksum, bit for bit the same result as the old word by word loop
+        return icmpChecksum.checksum(dataToChecksum)
+
+    def openCapture(self, args):
+        # One pcap file for every session of the run, when --pcap was given
+        if not args.pcap:
+            return None
+        return pcapWriter.PcapWriter(args.pcap)
+
+    def closeCapture(self):
+        if self.capture is not None:
+            self.capture.close()
+            print("%d packets written to %s" % (self.capture.packets, self.capture.filename))
+
+    def resolveHost(self, hostname, family=socket.AF_INET):
+        # Cached lookup shared with earlier runs, raises socket.gaierror like socket.gethostbyname
+        # (family None takes the address the system prefers, of either family)
+        with hostResolver.HostResolver() as resolver:
+            return resolver.resolve(hostname, family)
+
+    def resolveAddresses(self, hostname, family=None):
+        # The first address of each family (or of the one asked for), IPv4 first
+        with hostResolver.HostResolver() as resolver:
+            addresses = resolver.resolveAll(hostname)
+        families = [family] if family else [socket.AF_INET, socket.AF_INET6]
+        addresses = [hostResolver.pickAddress(addresses, family) for family in families]
+        addresses = [address for address in addresses if address is not None]
+        if not addresses:
+            raise socket.gaierror(socket.EAI_ADDRFAMILY, 'no address of that family for %s' % (hostname))
+        return addresses
+
+    def resolveTargets(self, hostnames, block=True):
+        # Names resolve in parallel, each target is probed as soon as its address is known. Without
+        # block a None comes through whenever no name has resolved yet, as resolveMany hands it out.
+        with hostResolver.HostResolver() as resolver:
+            for answer in resolver.resolveMany(hostnames, block=block):
+                if answer is None:
+                    yield None
+                    continue
+                hostname, address = answer
+                if address is None:
+                    print("%s: cannot resolve hostname" % (hostname))
+                    continue
+                yield hostname, address
 
     def printOneResult(self, destinationAddress: str, packetLength: int, time: float, ttl: int, destinationHostname=''):
 
@@ -90,179 +192,445 @@ class NetworkApplication:
             print("%d bytes from %s: ttl=%dtime=%.2f ms" %
                   (packetLength, destinationAddress, ttl, time))
 
-    def printAdditionalDetails(self, packetLoss=0.0, minimumDelay=0.0, averageDelay=0.0, maximumDelay=0.0):
+    def printAdditionalDetails(self, packetLoss=0.0, minimumDelay=0.0, averageDelay=0.0, maximumDelay=0.0,
+                               standardDeviation=0.0, jitter=0.0, percentiles=(),
+                               duplicates=0, lateReplies=0, reordered=0):
         print("%.2f%% packet loss" % (packetLoss))
         if minimumDelay > 0 and averageDelay > 0 and maximumDelay > 0:
-            print("rtt min/avg/max = %.2f/%.2f/%.2fms" %
-                  (minimumDelay, averageDelay, maximumDelay))
+            print("rtt min/avg/max/stddev = %.2f/%.2f/%.2f/%.2fms" %
+                  (minimumDelay, averageDelay, maximumDelay, standardDeviation))
+            print("rtt jitter = %.2fms" % (jitter))
+        if percentiles:
+            print("rtt %s = %sms" % ('/'.join('p%g' % (percent) for percent, delay in percentiles),
+                                     '/'.join('%.2f' % (delay) for percent, delay in percentiles)))
+        if duplicates or lateReplies or reordered:
+            print("%d duplicate, %d late, %d reordered replies" % (duplicates, lateReplies, reordered))
 
 
 class ICMPPing(NetworkApplication):
 
-    def receiveOnePing(self, icmpSocket, destinationAddress, ID, timeout):
-
-        # 1. Wait for the socket to receive a reply. #2. Once received, record time of receipt, otherwise, handle a timeout
-        try:
-            timeRecieved = time.time()
-            information, address = icmpSocket.recvfrom(1024)
-            timeSent = information.split()[2]
-            
-            # 3. Compare the time of receipt to time of sending, producing the total network delay
-            timeSent= self.sendOnePing(icmpSocket, destinationAddress, 111)
-            totalNetworkDelay = (timeRecieved*1000) - timeSent
-            
-            # 4. Unpack the packet header for useful information, including the ID
-            icmpType, icmpCode, icmpChecksum, icmpPacketID, icmpSeqNumber = struct.unpack("bbHHh", icmpHeader)
-
-            # 5. Check that the ID matches between the request and reply AND THEN 6. Return total network delay
-            if(icmpPacketID == self.ID):
-                return totalNetworkDelay
-
-            else:
-                return 0
-
-        except timeout: # No response received, print the timeout message
-            print("Request timed out")
-
-
+    def receiveOnePing(self, session, destinationAddress, sequence, timeout):
+        # 1. Wait for the shared socket to receive a reply, otherwise handle a timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            reply = session.receiveOnePing(deadline - time.monotonic())
+            if reply is None:
+                print("Request timed out")
+                return None
+
+            # 2. Check that the reply answers this probe, late replies to earlier probes are skipped
+            if reply.destination != destinationAddress:
+                continue
+            if reply.sequence != sequence:
+                continue
+            return reply
+
+    def sendOnePing(self, session, destinationAddress, size=None):
+        # 1. Build, checksum and send the echo request on the shared socket, padded to size bytes if given
+        sequence, timeSent = session.sendOnePing(destinationAddress, size=size)
+        # 2. Return the sequence number and time of sending
+        return sequence, timeSent
 
-    def sendOnePing(self, icmpSocket, destinationAddress, ID):
-        # 1. Build ICMP header
-        icmpHeader=struct.pack("bbHHh", 8, 0, 0, ID, 1)
+    def doOnePing(self, destinationAddress, timeout):
+        # 1. Call sendOnePing function on the socket opened for this run
+        sequence, timeSent = self.sendOnePing(self.session, destinationAddress)
 
-        # 2. Checksum ICMP packet using given function
-        icmpChecksum = self.checksum(icmpHeader)
+        # 2. Call receiveOnePing function
+        reply = self.receiveOnePing(self.session, destinationAddress, sequence, timeout)
+        if reply is None:
+            return None
 
-        # 3. Insert checksum into packet
-        icmpHeader = struct.pack("bbHHh", 8, 0, icmpChecksum, ID, 1)
+        # 3. Compare the time of receipt to time of sending, producing the total network delay
+        if reply.timeSent is not None:
+            timeSent = reply.timeSent
+        networkDelay = (reply.timeReceived - timeSent) / 1000000
+        return networkDelay, reply
 
-        # 4. Send packet using socket- double check this //run with wireshark
-        icmpSocket.sendto(icmpHeader, (destinationAddress, 1))
-        
-        # 5. Record time of sending
-        timeSent=time.time()
-        return timeSent
+    def pingOneHost(self, streams, scheduler):
+        # streams holds one PingStream per address family of the host, all probed at the same time
+        while True:
+            now = time.monotonic_ns()
+            # 1. Send every probe whose deadline has come, a late wakeup catches up so the rate stays exact
+            while scheduler.due(now):
+                for stream in streams:
+                    sequence, timeSent = self.sendOnePing(stream.session, stream.address)
+                    stream.window.probeSent(stream.session.sequence, timeSent)
+                scheduler.probeSent()
+
+            # 2. Probes whose timeout has passed on the timer wheel are lost
+            for stream in streams:
+                for probeNumber, data in stream.window.expire(now):
+                    stream.statistics.addLoss()
+                    print("Request timed out" if len(streams) == 1 else "Request timed out (%s)" % (stream.address))
+
+            # 3. Stop once count probes are answered or lost, or straight away on the overall deadline
+            if scheduler.expired(now):
+                for stream in streams:
+                    stream.statistics.addLoss(stream.window.outstanding)
+                return
+            if scheduler.finished(now) and not any(stream.window.outstanding for stream in streams):
+                return
+
+            # 4. Wait for replies on any of the sockets until the next probe or timeout is due
+            wakeUp = scheduler.wakeUpTime(now, *[stream.window.nextExpiry(now) for stream in streams])
+            readable = select.select([stream.session for stream in streams], [], [], scheduler.waitTime(now, wakeUp))[0]
+            for stream in streams:
+                if stream.session in readable:
+                    self.handleReply(stream, stream.session.receiveOnePing(0))
+
+    def handleReply(self, stream, reply):
+        if reply is None:
+            return
+        if reply.destination != stream.address:
+            return
+        probeNumber = reply.probeNumber if reply.probeNumber is not None else stream.window.unwrap(reply.sequence)
+        status, data = stream.window.replyReceived(probeNumber)
+        if status == probeWindow.DUPLICATE:
+            print("%d bytes from %s: duplicate reply (DUP!)" % (reply.packetLength, reply.address))
+            return
+        if status == probeWindow.LATE:
+            print("%d bytes from %s: reply arrived after the timeout" % (reply.packetLength, reply.address))
+            return
+        if status == probeWindow.UNKNOWN:
+            return
+
+        # 5. Print out the returned delay (and other relevant details) using the printOneResult method
+        if reply.icmpType != icmpSession.ICMP_ECHO_REPLY:
+            stream.statistics.addLoss()
+            print("From %s: %s" % (reply.address,
+                                   icmpDecoder.describe(reply.icmpType, reply.icmpCode, stream.session.family)))
+            return
+        # 6. The send time comes back in the echoed payload
+        returnedDelay = (reply.timeReceived - reply.timeSent) / 1000000
+        stream.statistics.addDelay(returnedDelay)
+        self.printOneResult(stream.address, reply.packetLength, returnedDelay, reply.ttl)
+
+    def expandTarget(self, hostname):
+        # Ranges are expanded one address at a time, in random order
+        if not targetRange.isTargetRange(hostname):
+            yield hostname
+            return
+        try:
+            yield from targetRange.expandTargetRange(hostname)
+        except ValueError as error:
+            print(error)
+
+    def readTargets(self, args):
+        # 1. The hostname argument first, then the target file line by line so large lists are never held in memory
+        if args.hostname:
+            yield from self.expandTarget(args.hostname)
+        if not args.file:
+            return
+        targetFile = sys.stdin if args.file == '-' else open(args.file)
+        with targetFile:
+            for line in targetFile:
+                hostname = line.split('#')[0].strip()
+                if hostname:
+                    yield from self.expandTarget(hostname)
+
+    def pingManyHosts(self, args):
+        print('Ping to: many hosts from %s...' % (args.file or args.hostname))
+        timeout = args.timeout or 1
+        statistics = rttStatistics.RTTStatistics()
+        # a range sweep is paced unless a rate is given, --rate 0 sends it flat out
+        rate = args.rate
+        if rate is None and args.hostname and targetRange.isTargetRange(args.hostname):
+            rate = targetRange.SWEEP_RATE
+
+        # 1. Send interleaved probes to every target over one ICMP socket
+        self.session = icmpSession.ICMPSession(args.unprivileged, capture=self.capture)
+        with self.session:
+            engine = multiPing.MultiPing(self.session, timeout, rate=rate)
+            # 2. Print each result as soon as its reply arrives or its timeout passes
+            try:
+                for result in engine.run(self.resolveTargets(self.readTargets(args), block=False)):
+                    if result.delay is None:
+                        statistics.addLoss()
+                        if result.reply is None:
+                            print("%s (%s): request timed out" % (result.target, result.address))
+                        else:
+                            print("%s (%s): %s from %s" % (result.target, result.address,
+                                  icmpDecoder.describe(result.reply.icmpType, result.reply.icmpCode),
+                                  result.reply.address))
+                        continue
+                    statistics.addDelay(result.delay)
+                    self.printOneResult(result.address, result.reply.packetLength, result.delay,
+                                        result.reply.ttl, result.target)
+            except KeyboardInterrupt:
+                pass
+
+        # 3. Summarise the whole sweep
+        if statistics.sent:
+            self.printAdditionalDetails(**statistics.details(), **engine.window.details())
+
+    def floodHost(self, args):
+        print('Flood ping to: %s...' % (args.hostname))
+        ipAddress = self.resolveHost(args.hostname, args.family)
+        timeout = args.timeout or 1
+
+        # 1. Send batches of probes at the requested rate, or flat out, on one ICMP socket
+        self.session = icmpSession.ICMPSession(args.unprivileged, hostResolver.addressFamily(ipAddress), self.capture)
+        with self.session:
+            engine = floodPing.FloodPing(self.session, ipAddress, args.rate, timeout, args.count, args.deadline)
+            try:
+                engine.run()
+            except KeyboardInterrupt:
+                print()
+
+        # 2. Summarise the run, with the rate that was actually achieved
+        now = time.monotonic_ns()
+        print("%d probes sent in %.2fs, %.0f packets/s" % (engine.sent, engine.elapsed(now), engine.achievedRate(now)))
+        self.printAdditionalDetails(**engine.statistics.details(), **engine.window.details())
+
+    def pingHost(self, args):
+        print('Ping to: %s...' % (args.hostname))
+        # 1. Look up hostname, resolving it to an IPv4 and/or IPv6 address
+        addresses = self.resolveAddresses(args.hostname, args.family)
+        timeout = args.timeout or 1
+
+        # 2. Open one ICMP socket per address family for the whole run, dual-stack hosts are probed over both
+        streams = [PingStream(icmpSession.ICMPSession(args.unprivileged,
+                                                      hostResolver.addressFamily(address), self.capture),
+                              address, probeWindow.ProbeWindow(timeout), rttStatistics.RTTStatistics())
+                   for address in addresses]
+        scheduler = probeScheduler.ProbeScheduler(args.interval, args.count, args.deadline)
+        try:
+            self.pingOneHost(streams, scheduler)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for stream in streams:
+                stream.session.close()
+
+        # 3. Summarise the run, per address family when there was more than one
+        for stream in streams:
+            if len(streams) > 1:
+                print("%s:" % (stream.address))
+            self.printAdditionalDetails(**stream.statistics.details(), **stream.window.details())
 
-    def doOnePing(self, destinationAddress, timeout):
-        # 1. Create ICMP socket
-        # Translate an Internet protocol name (for example, 'icmp') to a constant suitable for passing as the (optional) third argument to the socket() function.
-        icmp_proto = socket.getprotobyname("icmp") #debugging
-        icmpSocket = socket.socket(socket.AF_INET, socket.SOCK_RAW, icmp_proto)
-        #icmpSocket = socket.socket(socket.AF_INET,socket.SOCK_RAW, socket.IPPROTO_ICMP)
+    def __init__(self, args):
+        # A target file or range switches to the multi-target engine, --flood and --rate to the batched one
+        self.capture = self.openCapture(args)
+        try:
+            if args.file or targetRange.isTargetRange(args.hostname):
+                self.pingManyHosts(args)
+            elif args.flood or args.rate:
+                self.floodHost(args)
+            else:
+                self.pingHost(args)
+        finally:
+            self.closeCapture()
 
-        # 2. Call sendOnePing function
-        timeSent = self.sendOnePing(icmpSocket, destinationAddress, 111)
 
-        # 3. Call receiveOnePing function
-        networkDelay = self.receiveOnePing(icmpSocket, destinationAddress, 111, 1000, timeSent)
+class Traceroute(NetworkApplication):
 
-        # 4. Close ICMP socket
-        icmpSocket.close()
+    def pingEachNode(self, ipAddress, TTL, timeout):
+        # 1. Set the TTL of the shared ICMP socket for this hop
+        self.session.setTTL(TTL)
+        # 2. Call sendNodePing function
+        sequence, timeSent = self.sendNodePing(self.session, ipAddress)
+        self.window.probeSent(self.session.sequence, timeSent, TTL)
+        # 3. Call recieveNodePing function
+        reply = self.recieveNodePing(self.session, ipAddress, self.session.sequence)
+        if reply is None:
+            return None
+        # 4. Compare the time of receipt to time of sending, producing the delay to this node
+        # (routers that quote only 8 bytes of the probe do not return the payload send time)
+        if reply.timeSent is not None:
+            timeSent = reply.timeSent
+        oneNodeDelay = (reply.timeReceived - timeSent) / 1000000
+        return oneNodeDelay, reply
+
+    def sendNodePing(self, session, ipAddress):
+        # 1. Build, checksum and send the echo request on the shared socket
+        sequence, timeSent = session.sendOnePing(ipAddress)
+        # 2. Return the sequence number and time of sending
+        return sequence, timeSent
+
+    def recieveNodePing(self, session, destinationAddress, probeNumber):
+        # 1. Wait for the time exceeded or echo reply quoting this probe, otherwise handle a timeout
+        while True:
+            now = time.monotonic_ns()
+            for expiredNumber, TTL in self.window.expire(now):
+                if expiredNumber == probeNumber:
+                    return None
+            nextExpiry = self.window.nextExpiry(now)
+            reply = session.receiveOnePing(max(nextExpiry - now, 0) / 1000000000)
+            # 2. Check that the reply is about a probe to this destination (errors quote where it was going)
+            if reply is None or reply.destination != destinationAddress:
+                continue
+            # 3. Check that the reply answers this probe, late answers for earlier hops are only counted
+            replyNumber = reply.probeNumber if reply.probeNumber is not None else self.window.unwrap(reply.sequence)
+            status, TTL = self.window.replyReceived(replyNumber)
+            if replyNumber == probeNumber and status == probeWindow.NEW:
+                return reply
+
+    def reportNode(self, TTL, result, statistics):
+        # Prints one hop, returns True when the trace ends with it
+        if result is None:
+            statistics.addLoss()
+            print("%d * Request timed out" % (TTL))
+            return False
+        nodeDelay, reply = result
+        statistics.addDelay(nodeDelay)
+        # 4. Print out the returned delay (and other relevant details) using the printOneResult method
+        self.printOneResult(reply.address, reply.packetLength, nodeDelay, TTL)
+        # 5. Continue this process while routers on the way answer, stop at the destination
+        # or at a router that reports it cannot be reached
+        kind = icmpDecoder.messageKind(reply.icmpType)
+        if kind == icmpDecoder.UNREACHABLE:
+            print("%d %s: %s" % (TTL, reply.address,
+                                 icmpDecoder.describe(reply.icmpType, reply.icmpCode, self.session.family)))
+        return kind != icmpDecoder.TRANSIT
+
+    def traceEachNode(self, ipAddress, maxHops, timeout, statistics):
+        # 3. Call pingEachNode function approximately every second, one TTL further each time
+        for TTL in range(1, maxHops + 1):
+            time.sleep(1)
+            if self.reportNode(TTL, self.pingEachNode(ipAddress, TTL, timeout), statistics):
+                break
 
-        # 5. Return total network delay
-        return networkDelay
+    def sendAllNodePings(self, ipAddress, maxHops):
+        # One probe for every TTL back to back, returns {TTL: time sent}
+        timesSent = {}
+        for TTL in range(1, maxHops + 1):
+            self.session.setTTL(TTL)
+            sequence, timesSent[TTL] = self.sendNodePing(self.session, ipAddress)
+            self.window.probeSent(self.session.sequence, timesSent[TTL], TTL)
+        return timesSent
+
+    def recieveAllNodePings(self, ipAddress, maxHops):
+        # Collects {TTL: reply} until every hop short of the destination is answered or timed out
+        replies = {}
+        unsettled = set(range(1, maxHops + 1))
+        # lowest TTL that reached the destination (or a router that gave up on it), None until one did
+        lastTTL = None
+        while unsettled and (lastTTL is None or min(unsettled) < lastTTL):
+            now = time.monotonic_ns()
+            for expiredNumber, TTL in self.window.expire(now):
+                unsettled.discard(TTL)
+            nextExpiry = self.window.nextExpiry(now)
+            if nextExpiry is None:
+                break
+            reply = self.session.receiveOnePing(max(nextExpiry - now, 0) / 1000000000)
+            # 1. Only replies about probes to this destination (errors quote where it was going)
+            if reply is None or reply.destination != ipAddress:
+                continue
+            # 2. The quoted payload says which probe it answers, routers quoting only 8 bytes leave the sequence
+            replyNumber = reply.probeNumber if reply.probeNumber is not None else self.window.unwrap(reply.sequence)
+            status, TTL = self.window.replyReceived(replyNumber)
+            if status not in (probeWindow.NEW, probeWindow.REORDERED):
+                continue
+            replies[TTL] = reply
+            unsettled.discard(TTL)
+            if icmpDecoder.messageKind(reply.icmpType) != icmpDecoder.TRANSIT and (lastTTL is None or TTL < lastTTL):
+                lastTTL = TTL
+        return replies, lastTTL or maxHops
+
+    def traceAllNodes(self, ipAddress, maxHops, statistics):
+        # 3. Probe every TTL at once, the whole path costs one timeout instead of one per hop
+        timesSent = self.sendAllNodePings(ipAddress, maxHops)
+        replies, lastTTL = self.recieveAllNodePings(ipAddress, maxHops)
+        for TTL in range(1, lastTTL + 1):
+            reply = replies.get(TTL)
+            result = None
+            if reply is not None:
+                timeSent = reply.timeSent if reply.timeSent is not None else timesSent[TTL]
+                result = (reply.timeReceived - timeSent) / 1000000, reply
+            if self.reportNode(TTL, result, statistics):
+                break
 
     def __init__(self, args):
-        print('Ping to: %s...' % (args.hostname))
+        # Please ensure you print each result using the printOneResult method!
+        print('Traceroute to: %s...' % (args.hostname))
         # 1. Look up hostname, resolving it to an IP address
-        ipAddress = socket.gethostbyname(args.hostname)
+        ipAddress = self.resolveHost(args.hostname, args.family)
+        timeout = args.timeout or 1
+
+        # 2. Open one ICMP socket for every hop of the run, of the family the address belongs to
+        self.capture = self.openCapture(args)
+        self.session = icmpSession.ICMPSession(args.unprivileged, hostResolver.addressFamily(ipAddress), self.capture)
+        statistics = rttStatistics.RTTStatistics()
+        self.window = probeWindow.ProbeWindow(timeout)
+        try:
+            with self.session:
+                if args.parallel:
+                    self.traceAllNodes(ipAddress, args.max_hops, statistics)
+                else:
+                    self.traceEachNode(ipAddress, args.max_hops, timeout, statistics)
+        finally:
+            self.closeCapture()
 
-        # 2. Call doOnePing function approximately every second
-        while True:
-            time.sleep(1)
-            debuggingTimeout = args.timeout
-            print("testing:", ipAddress, debuggingTimeout)
-            returnedDelay = self.doOnePing(ipAddress, debuggingTimeout)
-            # 3. Print out the returned delay (and other relevant details) using the printOneResult method
-            self.printOneResult(ipAddress, 50, returnedDelay, 150)
-            #Example use of printOneResult - complete as appropriate
-            # 4. Continue this process until stopped - did this through the while True
+        # 6. Summarise the per hop delays
+        self.printAdditionalDetails(**statistics.details(), **self.window.details())
 
 
-class Traceroute(NetworkApplication):
+class PathMTU(NetworkApplication):
 
     def __init__(self, args):
-    #
-        # Please ensure you print each result using the printOneResult method!
-        print('Traceroute to: %s...' % (args.hostname))
-        # 1. Look up hostname, resolving it to an IP address
-        ipAddress= socket.gethostbyname(args.hostname)
-        numberofNodes= 0  # create variable and initialise
-        # 2. Call PingOneNode function approximately every second
-        while True:
-            time.sleep(1)
-            #nodalDelay = self.pingOneNode(ipAddress, args.timeout, 1)
-            
-            nodalDelay = self.pingOneNode()
-            self.printOneResult(ipAddress, 50, nodalDelay[1]*1000, 150)
-            numberofNodes = numberofNodes + 1  # increments number of nodes
-            
-            # 4. Continue this process until stopped - until ICMP = 0
-            if self.ICMP_CODE == 0:
-                break
-            # 3. Print out the returned delay (and other relevant details) using the printOneResult method
-            # check this don't think its right
-            self.printOneResult(ipAddress, 50, nodalDelay[1]*1000, 150)
-
-    def pingOneNode(self):
-        # 1. Create ICMP socket
-        icmp_proto = socket.getprotobyname("icmp") #debugging
-        icmpSocket= socket.socket(socket.AF_INET, socket.SOCK_RAW, icmp_proto)
-        # 2. Call sendNodePing function
-        timeSent= self.sendNodePing(icmpSocket, self.ipAddress, 111)
-        # 3. Call recieveNodePing function
-        networkDelay= self.recieveNodePing(icmpSocket, self.ipAddress, 111, 1000, timeSent)
-         # 4. Close ICMP socket
-        icmpSocket.close()
-        # 5. Return total network delay- add up all the nodes
-        x = 0 
-        for x in self.numberOfNodes:
-            totalDelay = (networkDelay[x] + networkDelay[x + 1])
-            x = x + 1
-            if x == self.numberOfNodes:
-                break
-            return totalDelay
-
-    def sendNodePing(icmpSocket):
-         # 1. Build ICMP header
-        icmpHeader= struct.pack("bbHHh", 8, 0, 0, ID, 1)
-        # 2. Checksum ICMP packet using given function
-        icmpChecksum= self.checksum(icmpHeader)
-         # 3. Insert checksum into packet
-        packetHeader= struct.pack("bbHHh", 8, 0, icmpChecksum, ID, 1)
-        packet= packetHeader
-        # 4. Send packet using socket
-        # double check this //run with wireshark
-        icmpSocket.sendto(packet, (self.icmpAddress, 1))
-        # 5. Record time of sending
-        sentTime= time.time()
-        return sentTime
-
-    def recieveNodePing(icmpSocket):
-        # 1. Wait for the socket to receive a reply- TTL = 0
-        sentTime= time.time()
-        ## Set the TTL for messages to 1 so they do not go past the local network segment
-        #TTL = socket.recvmessage()
-        
-        TTL = struct.pack('b', 1)
-        icmpSocket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, TTL)
-        # 2. Once received, record time of receipt, otherwise, handle a timeout
-        try:  # TTL == 0
-            timeRecieved = time.time()
-            # 3. Compare the time of receipt to time of sending, producing the total network delay- did when calculated RTT? 
-            totalNetworkDelay = (timeRecieved * 1000) - sentTime
-            # 4. Unpack the packet header for useful information, including the ID
-            icmpType, icmpCode, icmpChecksum, icmpPacketID, icmpSeqNumber= struct.unpack("bbHHh", icmpHeader)
-            # 5. Check that the ID matches between the request and reply and # 6. Return total network delay
-            if(icmpPacketID == self.ID):
-                return totalNetworkDelay
-            else:
-                return 0     
-        
-        except TTL != 0:  #if nothing is recieved, handle a timeout
-            print("TTL is 0 - socket has not recieved a reply")
-            return None
-        
+        print('Path MTU to: %s...' % (', '.join(args.hostnames)))
+        timeout = args.timeout or 1
+        targets = list(self.resolveTargets(args.hostnames))
+
+        # 1. Probe a spread of sizes with DF set to every host at once, round after round
+        self.session = icmpSession.ICMPSession(args.unprivileged)
+        with self.session:
+            discovery = pathMTU.PathMTUDiscovery(self.session, timeout, args.parallel)
+            for search in discovery.run(targets):
+                # 2. Report what the routers said along the way, then the size that got through
+                for router, mtu in search.events:
+                    print("%s (%s): from %s: fragmentation needed, next hop MTU %d" % (
+                        search.target, search.address, router, mtu))
+                if not search.reachable():
+                    print("%s (%s): no reply" % (search.target, search.address))
+                    continue
+                print("%s (%s): path MTU %d bytes after %d rounds" % (
+                    search.target, search.address, search.pathMTU(), search.rounds))
+
+
+class Replay(NetworkApplication):
+
+    def printHop(self, ttl, hop):
+        statistics = hop.statistics
+        if not statistics.received:
+            print("%d * Request timed out" % (ttl))
+            return
+        print("%d %s %.2f ms (%d of %d answered)" % (
+            ttl, ', '.join(hop.responders), statistics.mean, statistics.received, statistics.sent))
+
+    def __init__(self, args):
+        print('Replay of: %s...' % (args.capture))
+        timeout = args.timeout or 1
+
+        # 1. Map the capture and stream every packet through the reply parsers and probe windows
+        try:
+            reader = pcapReader.PcapReader(args.capture)
+        except (OSError, ValueError) as error:
+            print(error)
+            return
+        replay = pcapReplay.CaptureReplay(timeout)
+        started = time.perf_counter()
+        with reader:
+            replay.replay(reader.packets())
+            replay.finish()
+        elapsed = time.perf_counter() - started
+
+        # 2. One summary per destination, hop by hop where probes went out with more than one TTL
+        for destination, hops, statistics in replay.results():
+            print("Replay to %s:" % (destination))
+            if len(hops) > 1:
+                for ttl, hop in hops:
+                    self.printHop(ttl, hop)
+            self.printAdditionalDetails(**statistics.details())
+        details = replay.details()
+        if any(details.values()):
+            print("%d duplicate, %d late, %d reordered replies" % (
+                details['duplicates'], details['lateReplies'], details['reordered']))
+
+        # 3. How fast the parsing path went
+        print("%d packets, %d probes, %d replies (%d unmatched) in %.2f s: %.0f packets/s" % (
+            reader.frames, replay.probes, replay.replies, replay.unmatched, elapsed,
+            reader.frames / elapsed if elapsed else 0))
 
 
 class WebServer(NetworkApplication):
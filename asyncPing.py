@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+import asyncio
+import time
+
+import icmpSession
+
+
+class AsyncICMPSession:
+    # asyncio front end for an ICMPSession. The socket is watched with
+    # loop.add_reader, every reply resolves the future of the probe it answers,
+    # so any number of coroutines can await RTTs over the one shared socket
+    # without ever blocking the event loop.
+    #
+    #   async with AsyncICMPSession(icmpSession.ICMPSession()) as pinger:
+    #       networkDelay, reply = await pinger.doOnePing('192.0.2.1', timeout=1)
+    #
+    # An ICMP error about the probe (destination unreachable, time exceeded)
+    # answers it too but is a loss: networkDelay is None and reply says why.
+
+    def __init__(self, session):
+        self.session = session
+        self.loop = None
+        self.waiting = {}
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.session.fileno(), self.readReplies)
+
+    def close(self):
+        # Closing wakes every waiting coroutine instead of leaving it hanging
+        if self.loop is not None:
+            self.loop.remove_reader(self.session.fileno())
+            self.loop = None
+        for future, destinationAddress in self.waiting.values():
+            if not future.done():
+                future.cancel()
+        self.waiting.clear()
+        self.session.close()
+
+    def readReplies(self):
+        # 1. Drain everything queued on the socket, the reader fires once per wakeup
+        reply = self.session.receiveOnePing(0)
+        while reply is not None:
+            # 2. Hand each reply to the coroutine awaiting that identifier and sequence
+            entry = self.waiting.get((reply.ID, reply.sequence))
+            if entry is not None:
+                future, destinationAddress = entry
+                if not future.done() and reply.destination == destinationAddress:
+                    future.set_result(reply)
+            reply = self.session.receiveOnePing(0)
+
+    async def doOnePing(self, destinationAddress, timeout):
+        # 1. Send the echo request and register a future for its reply
+        sequence, timeSent = self.session.sendOnePing(destinationAddress)
+        key = (self.session.ID, sequence)
+        future = self.loop.create_future()
+        self.waiting[key] = (future, destinationAddress)
+        # 2. Await it, asyncio.TimeoutError and cancellation reach the caller unchanged
+        try:
+            reply = await asyncio.wait_for(future, timeout)
+        finally:
+            self.waiting.pop(key, None)
+        # 3. An error from a router or the destination is a loss, only an echo reply has a delay
+        if reply.icmpType != icmpSession.ICMP_ECHO_REPLY:
+            return None, reply
+        # 4. Compare the time of receipt to time of sending, producing the total network delay
+        networkDelay = (reply.timeReceived - timeSent) / 1000000
+        return networkDelay, reply
+
+    async def pingLoop(self, destinationAddress, count=None, interval=1.0, timeout=1.0):
+        # Async generator yielding (networkDelay, reply) per probe, (None, reply) when an ICMP error
+        # answered it and (None, None) when one times out.
+        # Probes go out every interval seconds, independent of how long replies take.
+        pending = []
+        sent = 0
+        nextSend = time.monotonic()
+        try:
+            while count is None or sent < count:
+                pending.append(asyncio.ensure_future(self.doOnePing(destinationAddress, timeout)))
+                sent += 1
+                nextSend += interval
+                # Yield every probe that has finished, in sending order, before the next one goes out
+                while pending and (pending[0].done() or count is not None and sent >= count):
+                    try:
+                        yield await pending.pop(0)
+                    except asyncio.TimeoutError:
+                        yield None, None
+                if count is None or sent < count:
+                    await asyncio.sleep(max(nextSend - time.monotonic(), 0))
+        finally:
+            for task in pending:
+                task.cancel()
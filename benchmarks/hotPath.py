@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+# Per-packet cost of the hot path - checksum, probe build, reply parse and
+# capture - across packet sizes. Needs neither root nor a network. Run from
+# the repository root:
+#
+#   python3 benchmarks/hotPath.py                       print the timings
+#   python3 benchmarks/hotPath.py --output run.json     also keep them as JSON
+#   python3 benchmarks/hotPath.py --save-baseline       make them the stored baseline
+#   python3 benchmarks/hotPath.py --baseline            compare, exit 1 on a regression
+#
+# A case regresses when it is more than --tolerance slower than the baseline.
+# Shared machines speed up and slow down as a whole from one run to the next,
+# so each run also times a fixed reference loop and cases are compared after
+# scaling by how the reference moved. Timings only compare on the same machine
+# and Python, a baseline taken elsewhere is reported as such.
+import argparse
+import json
+import os
+import platform
+import socket
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import icmpChecksum
+import icmpDecoder
+import icmpSession
+import packetBuilder
+import pcapWriter
+import probeBuild
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# bytes checksummed: a bare probe, the classic ping, a 576 byte datagram, Ethernet and jumbo MTUs
+CHECKSUM_SIZES = (36, 64, 576, 1500, 9000)
+# padding after the echo payload: none, up to the classic 64 byte ping, up to a 1500 byte MTU
+PADDING_SIZES = (0, 28, 1436)
+# slower than the baseline by more than this fraction is a regression
+TOLERANCE = 0.25
+# each timing run lasts at least this long; every case is run once per round, round after
+# round, and its best run counts, so a slow spell of the machine hits every case alike
+MINIMUM_RUN_SECONDS = 0.01
+ROUNDS = 15
+
+# plain interpreter work nothing in the repository changes, the yardstick for the machine's speed
+REFERENCE = 'reference loop'
+
+IDENTIFIER = probeBuild.IDENTIFIER
+TIME_SENT = probeBuild.TIME_SENT
+LOCAL = '10.0.0.1'
+REMOTE = '10.0.0.2'
+ROUTER = '10.0.0.254'
+
+
+def ipv4Packet(source, destination, icmp):
+    packet = bytearray(packetBuilder.IPV4_HEADER.size) + icmp
+    packetBuilder.packIPv4Header(packet, 0, source, destination, socket.IPPROTO_ICMP, len(icmp), 63)
+    return bytes(packet)
+
+
+def echoPackets(padding):
+    # An echo request as we send it, the reply to it, and a time exceeded quoting the request
+    request = bytes(packetBuilder.EchoTemplate(icmpSession.ICMP_ECHO_REQUEST, IDENTIFIER).build(
+        1, TIME_SENT, padding=padding))
+    reply = bytearray(request)
+    reply[0] = icmpSession.ICMP_ECHO_REPLY
+    packetBuilder.CHECKSUM_FIELD.pack_into(reply, 2, 0)
+    packetBuilder.CHECKSUM_FIELD.pack_into(reply, 2, packetBuilder.internetChecksum(reply))
+    # routers quote the datagram up to 576 bytes all told (RFC 1812)
+    quoted = ipv4Packet(LOCAL, REMOTE, request)[:576 - 2 * packetBuilder.IPV4_HEADER.size - 8]
+    exceeded = bytearray(packetBuilder.ICMP_HEADER.size) + quoted
+    packetBuilder.packICMPHeader(exceeded, 0, icmpSession.ICMP_TIME_EXCEEDED, 0, 0, 0, len(quoted))
+    return request, ipv4Packet(REMOTE, LOCAL, reply), ipv4Packet(ROUTER, LOCAL, exceeded)
+
+
+def referenceLoop(probe):
+    total = 0
+    for value in range(100):
+        total += value * probe
+    return total
+
+
+def checksumCases():
+    for size in CHECKSUM_SIZES:
+        data = bytes(range(256)) * (size // 256) + bytes(range(size % 256))
+        batch = [data] * 64
+        yield 'checksum/%d' % (size), lambda probe, data=data: icmpChecksum.checksum(data)
+        yield 'checksum loop (old)/%d' % (size), lambda probe, data=data: probeBuild.loopChecksum(data)
+        yield 'checksumBatch per packet/%d' % (size), lambda probe, batch=batch: icmpChecksum.checksumBatch(batch), 64
+
+
+def buildCases():
+    template = packetBuilder.EchoTemplate(icmpSession.ICMP_ECHO_REQUEST, IDENTIFIER)
+    buffer = bytearray(packetBuilder.ECHO_PACKET.size)
+    yield 'build format strings (old)/0', probeBuild.packTwice
+    yield 'build EchoTemplate.packInto/0', lambda probe: template.packInto(buffer, 0, probe, TIME_SENT)
+    for padding in PADDING_SIZES:
+        yield 'build EchoTemplate.build/%d' % (padding), \
+            lambda probe, padding=padding: template.build(probe, TIME_SENT, padding=padding)
+
+
+def parseCases():
+    address = (REMOTE, 0)
+    for padding in PADDING_SIZES:
+        request, reply, exceeded = echoPackets(padding)
+        yield 'parse decodeMessage echo reply/%d' % (padding), \
+            lambda probe, reply=reply: icmpDecoder.decodeMessage(reply, packetBuilder.IPV4_HEADER.size)
+        yield 'parse IPv4 echo reply/%d' % (padding), \
+            lambda probe, reply=reply: icmpSession.parseIPv4Reply(reply, address, TIME_SENT, IDENTIFIER)
+        yield 'parse IPv4 time exceeded/%d' % (padding), \
+            lambda probe, exceeded=exceeded: icmpSession.parseIPv4Reply(exceeded, address, TIME_SENT, IDENTIFIER)
+        # raw IPv6 sockets read from the ICMPv6 header on, the reply has the same layout
+        replyV6 = bytearray(reply[packetBuilder.IPV4_HEADER.size:])
+        replyV6[0] = icmpSession.ICMPV6_ECHO_REPLY
+        yield 'parse IPv6 echo reply/%d' % (padding), \
+            lambda probe, replyV6=bytes(replyV6): icmpSession.parseIPv6Reply(replyV6, address, 63, TIME_SENT,
+                                                                              IDENTIFIER)
+
+
+class CaptureSession:
+    # The session attributes the capture reads
+    family = socket.AF_INET
+    unprivileged = False
+    ttl = None
+
+
+def captureCases():
+    # flushes go to /dev/null, what is timed is building the records
+    capture = pcapWriter.PcapWriter(os.devnull)
+    capture.localAddresses[REMOTE] = LOCAL
+    session = CaptureSession()
+    ancillary = [(socket.SOL_SOCKET, icmpSession.SO_TIMESTAMPNS, icmpSession.TIMESPEC.pack(1, 2))]
+    for padding in PADDING_SIZES:
+        request, reply, exceeded = echoPackets(padding)
+        replyView = memoryview(reply)
+        yield 'capture probeSent/%d' % (padding), \
+            lambda probe, request=request: capture.probeSent(session, request, REMOTE, TIME_SENT)
+        yield 'capture packetReceived/%d' % (padding), \
+            lambda probe, replyView=replyView: capture.packetReceived(session, replyView, ancillary, (REMOTE, 0))
+
+
+def cases():
+    # (name, function of the probe number, packets per call)
+    yield REFERENCE, referenceLoop, 1
+    for group in (checksumCases, buildCases, parseCases, captureCases):
+        for case in group():
+            yield case if len(case) == 3 else case + (1,)
+
+
+def calibrate(function):
+    # A timer for the case and how many calls make a run of at least MINIMUM_RUN_SECONDS
+    counter = iter(range(1 << 62))
+    timer = timeit.Timer(lambda: function(next(counter) & 0xffffffff))
+    number = 1
+    while timer.timeit(number) < MINIMUM_RUN_SECONDS:
+        number *= 2
+    return timer, number
+
+
+def measure(cases, rounds=ROUNDS):
+    # name -> best time in nanoseconds per packet, the cases taking turns for rounds rounds
+    timers = [(name, perCall) + calibrate(function) for name, function, perCall in cases]
+    best = {}
+    for round in range(rounds):
+        for name, perCall, timer, number in timers:
+            nanoseconds = timer.timeit(number) / number / perCall * 1e9
+            best[name] = min(best.get(name, nanoseconds), nanoseconds)
+    return best
+
+
+def environment():
+    return {'python': platform.python_version(), 'implementation': platform.python_implementation(),
+            'machine': platform.machine(), 'system': platform.system(), 'numpy': icmpChecksum.numpy is not None}
+
+
+def compare(results, baseline, tolerance):
+    # Prints each case against the baseline, returns the names of the ones that regressed
+    if baseline['environment'] != results['environment']:
+        print("baseline taken on %s, this run on %s, timings may not compare" % (
+            baseline['environment'], results['environment']))
+    # 1. How much faster or slower the machine is than when the baseline was taken
+    speed = 1.0
+    if REFERENCE in results['timings'] and REFERENCE in baseline['timings']:
+        speed = results['timings'][REFERENCE] / baseline['timings'][REFERENCE]
+        print("reference loop %+.1f%% against the baseline, changes below are scaled by it" % ((speed - 1) * 100))
+    # 2. Each case against its baseline time on a machine of today's speed
+    regressions = []
+    for name, nanoseconds in results['timings'].items():
+        before = baseline['timings'].get(name)
+        if name == REFERENCE:
+            continue
+        if before is None:
+            print("%-48s %10.0f ns/packet   (not in baseline)" % (name, nanoseconds))
+            continue
+        change = nanoseconds / (before * speed) - 1
+        flag = ''
+        if change > tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print("%-48s %10.0f ns/packet %+7.1f%%%s" % (name, nanoseconds, change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-packet cost of the checksum, build, parse and capture path')
+    parser.add_argument('--output', '-o', type=str, help='write the timings to this JSON file')
+    parser.add_argument('--baseline', '-b', type=str, nargs='?', const=BASELINE,
+                        help='compare against this JSON file (default %(const)s), exit 1 on a regression')
+    parser.add_argument('--save-baseline', type=str, nargs='?', const=BASELINE,
+                        help='store the timings as the baseline (default %(const)s)')
+    parser.add_argument('--tolerance', '-t', type=float, default=TOLERANCE,
+                        help='fraction slower than the baseline that counts as a regression')
+    parser.add_argument('--filter', '-k', type=str, default='', help='only run cases whose name contains this')
+    parser.add_argument('--rounds', '-r', type=int, default=ROUNDS, help='timing runs of every case')
+    args = parser.parse_args()
+
+    # 1. Time every case
+    # the reference loop always runs, the comparison needs it
+    timings = measure([case for case in cases() if args.filter in case[0] or case[0] == REFERENCE], args.rounds)
+    results = {'environment': environment(), 'timings': {name: round(value, 1) for name, value in timings.items()}}
+    if not args.baseline:
+        for name, nanoseconds in results['timings'].items():
+            print("%-48s %10.0f ns/packet" % (name, nanoseconds))
+
+    # 2. Keep them
+    for filename in (args.output, args.save_baseline):
+        if filename:
+            with open(filename, 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+                output.write('\n')
+
+    # 3. Compare, failing loudly
+    if args.baseline:
+        with open(args.baseline) as baselineFile:
+            baseline = json.load(baselineFile)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("%d of %d cases more than %.0f%% slower than %s: %s" % (
+                len(regressions), len(results['timings']) - (REFERENCE in results['timings']), args.tolerance * 100, args.baseline,
+                ', '.join(regressions)))
+            sys.exit(1)
+        print("no regressions against %s" % (args.baseline))
+
+
+if __name__ == '__main__':
+    main()
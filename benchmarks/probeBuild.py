@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+# Per-probe build cost of the packet builders, run from the repository root:
+#
+#   python3 benchmarks/probeBuild.py [--number N]
+import argparse
+import os
+import socket
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import packetBuilder
+
+IDENTIFIER = 0x1234
+TIME_SENT = 1234567890123
+
+
+def loopChecksum(dataToChecksum):
+    # The word by word checksum probes used to be built with, for comparison
+    csum = 0
+    countTo = (len(dataToChecksum) // 2) * 2
+    count = 0
+    while count < countTo:
+        thisVal = dataToChecksum[count + 1] * 256 + dataToChecksum[count]
+        csum = (csum + thisVal) & 0xffffffff
+        count = count + 2
+    if countTo < len(dataToChecksum):
+        csum = (csum + dataToChecksum[len(dataToChecksum) - 1]) & 0xffffffff
+    csum = (csum >> 16) + (csum & 0xffff)
+    csum = csum + (csum >> 16)
+    answer = ~csum & 0xffff
+    answer = answer >> 8 | (answer << 8 & 0xff00)
+    return socket.htons(answer)
+
+
+def packTwice(sequence):
+    # 1. Header with a zero checksum from a format string, 2. checksum, 3. the header again
+    payload = struct.pack("!4sQII", packetBuilder.PAYLOAD_MAGIC, TIME_SENT, sequence, 0)
+    header = struct.pack("!BBHHH", 8, 0, 0, IDENTIFIER, sequence & 0xffff)
+    icmpChecksum = socket.htons(loopChecksum(header + payload))
+    return struct.pack("!BBHHH", 8, 0, icmpChecksum, IDENTIFIER, sequence & 0xffff) + payload
+
+
+def cases():
+    # name -> function of the probe number that builds one probe
+    template = packetBuilder.EchoTemplate(8, IDENTIFIER)
+    buffer = bytearray(128)
+    payloadLength = packetBuilder.ECHO_PAYLOAD.size
+
+    def templateInto(sequence):
+        template.packInto(buffer, 0, sequence, TIME_SENT)
+
+    def echoHeaders(sequence):
+        packetBuilder.ECHO_PAYLOAD.pack_into(buffer, 28, packetBuilder.PAYLOAD_MAGIC, TIME_SENT, sequence, 0)
+        packetBuilder.packICMPHeader(buffer, 20, 8, 0, IDENTIFIER, sequence & 0xffff, payloadLength)
+        packetBuilder.packIPv4Header(buffer, 0, '10.0.0.1', '10.0.0.2', socket.IPPROTO_ICMP, 8 + payloadLength)
+
+    def udpProbe(sequence):
+        packetBuilder.packUDPHeader(buffer, 20, 33434, 33434 + (sequence & 0xff), 0, '10.0.0.1', '10.0.0.2')
+        packetBuilder.packIPv4Header(buffer, 0, '10.0.0.1', '10.0.0.2', socket.IPPROTO_UDP, 8)
+
+    def tcpProbe(sequence):
+        packetBuilder.packTCPHeader(buffer, 20, 40000, 80, sequence, source='10.0.0.1', destination='10.0.0.2')
+        packetBuilder.packIPv4Header(buffer, 0, '10.0.0.1', '10.0.0.2', socket.IPPROTO_TCP, 20)
+
+    return [
+        ('echo request, format strings + checksum loop', packTwice),
+        ('echo request, EchoTemplate.build', lambda sequence: template.build(sequence, TIME_SENT)),
+        ('echo request, EchoTemplate.packInto', templateInto),
+        ('IPv4 + ICMP echo, header builders', echoHeaders),
+        ('IPv4 + UDP, header builders', udpProbe),
+        ('IPv4 + TCP SYN, header builders', tcpProbe),
+    ]
+
+
+def measure(function, number):
+    # Best of five runs, in nanoseconds per probe
+    counter = iter(range(1 << 62))
+    best = min(timeit.repeat(lambda: function(next(counter) & 0xffffffff), number=number, repeat=5))
+    return best / number * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-probe build cost')
+    parser.add_argument('--number', '-n', type=int, default=100000, help='probes built per run')
+    args = parser.parse_args()
+    for name, function in cases():
+        print("%-48s %8.0f ns/probe" % (name, measure(function, args.number)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+import ctypes
+import ctypes.util
+import errno
+import select
+import socket
+import struct
+import time
+
+import icmpSession
+import probeWindow
+import rttStatistics
+
+# probes handed to the kernel, and replies taken from it, per system call
+BATCH_SIZE = 64
+# the live readout is refreshed this often
+REPORT_NS = 1000000000
+# a cmsghdr is size_t length, int level, int type, then the data aligned to size_t
+CMSG_HEADER = struct.Struct("@Nii")
+CMSG_ALIGNMENT = ctypes.sizeof(ctypes.c_size_t)
+
+
+class IOVec(ctypes.Structure):
+    _fields_ = [('base', ctypes.c_void_p), ('length', ctypes.c_size_t)]
+
+
+class MessageHeader(ctypes.Structure):
+    # struct msghdr
+    _fields_ = [('name', ctypes.c_void_p), ('nameLength', ctypes.c_uint32),
+                ('iov', ctypes.POINTER(IOVec)), ('iovLength', ctypes.c_size_t),
+                ('control', ctypes.c_void_p), ('controlLength', ctypes.c_size_t),
+                ('flags', ctypes.c_int)]
+
+
+class MultipleMessageHeader(ctypes.Structure):
+    # struct mmsghdr, length is filled in with the bytes sent or received
+    _fields_ = [('header', MessageHeader), ('length', ctypes.c_uint)]
+
+
+try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    sendmmsg = libc.sendmmsg
+    recvmmsg = libc.recvmmsg
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MultipleMessageHeader), ctypes.c_uint, ctypes.c_int]
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MultipleMessageHeader), ctypes.c_uint, ctypes.c_int,
+                         ctypes.c_void_p]
+except (OSError, AttributeError, TypeError):
+    # not Linux (or a libc without the calls), every packet gets a system call of its own
+    sendmmsg = recvmmsg = None
+
+
+def packAddress(destinationAddress):
+    # sockaddr_in or sockaddr_in6 for an address literal
+    if ':' in destinationAddress:
+        return icmpSession.SOCKADDR_IN6.pack(socket.AF_INET6, 0, 0,
+                                             socket.inet_pton(socket.AF_INET6, destinationAddress), 0)
+    return icmpSession.SOCKADDR_IN.pack(socket.AF_INET, 0, socket.inet_aton(destinationAddress))
+
+
+def unpackAddress(name):
+    # The (address, port) pair recvmsg would have returned
+    if struct.unpack_from("=H", name)[0] == socket.AF_INET6:
+        family, port, flowInfo, address, scope = icmpSession.SOCKADDR_IN6.unpack_from(name)
+        return socket.inet_ntop(socket.AF_INET6, address), port
+    family, port, address = icmpSession.SOCKADDR_IN.unpack_from(name)
+    return socket.inet_ntoa(address), port
+
+
+def alignCmsg(length):
+    return (length + CMSG_ALIGNMENT - 1) & ~(CMSG_ALIGNMENT - 1)
+
+
+def parseAncillary(control, length):
+    # The (level, type, data) list recvmsg would have returned for this control buffer
+    ancillary = []
+    offset = 0
+    while offset + CMSG_HEADER.size <= length:
+        cmsgLength, level, kind = CMSG_HEADER.unpack_from(control, offset)
+        if cmsgLength < CMSG_HEADER.size:
+            break
+        dataStart = offset + alignCmsg(CMSG_HEADER.size)
+        ancillary.append((level, kind, control[dataStart:offset + cmsgLength]))
+        offset += alignCmsg(cmsgLength)
+    return ancillary
+
+
+class BatchSocket:
+    # sendmmsg / recvmmsg front end for a socket: up to batchSize packets per
+    # system call instead of one. Every buffer and header is allocated once
+    # here and reused for every batch.
+
+    def __init__(self, icmpSocket, batchSize=BATCH_SIZE, packetSize=1024,
+                 controlSize=icmpSession.ANCILLARY_SPACE):
+        self.icmpSocket = icmpSocket
+        self.batchSize = batchSize
+        self.packetSize = packetSize
+        self.controlSize = controlSize
+        self.packets = [ctypes.create_string_buffer(packetSize) for index in range(batchSize)]
+        # byte views of the receive buffers, replies are parsed in place instead of copied out
+        self.views = [memoryview(packet).cast('B') for packet in self.packets]
+        self.names = [ctypes.create_string_buffer(icmpSession.SOCKADDR_IN6.size) for index in range(batchSize)]
+        self.controls = [ctypes.create_string_buffer(controlSize) for index in range(batchSize)]
+        self.iovecs = (IOVec * batchSize)()
+        self.messages = (MultipleMessageHeader * batchSize)()
+        for index in range(batchSize):
+            header = self.messages[index].header
+            header.name = ctypes.addressof(self.names[index])
+            header.iov = ctypes.pointer(self.iovecs[index])
+            header.iovLength = 1
+            self.iovecs[index].base = ctypes.addressof(self.packets[index])
+
+    def send(self, packets, destinationAddress):
+        # Returns how many of packets the kernel took, 0 when its send buffer is full
+        name = packAddress(destinationAddress)
+        for index, packet in enumerate(packets):
+            ctypes.memmove(self.packets[index], packet, len(packet))
+            ctypes.memmove(self.names[index], name, len(name))
+            header = self.messages[index].header
+            header.nameLength = len(name)
+            header.control = None
+            header.controlLength = 0
+            self.iovecs[index].length = len(packet)
+        sent = sendmmsg(self.icmpSocket.fileno(), self.messages, len(packets), socket.MSG_DONTWAIT)
+        if sent < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.ENOBUFS):
+                return 0
+            raise OSError(error, 'sendmmsg: ' + errno.errorcode.get(error, str(error)))
+        return sent
+
+    def receive(self):
+        # Returns [(information, ancillary, address)] for everything queued, at most batchSize of them.
+        # information is a view of a reused buffer, only valid until the next receive
+        for index in range(self.batchSize):
+            header = self.messages[index].header
+            header.nameLength = icmpSession.SOCKADDR_IN6.size
+            header.control = ctypes.addressof(self.controls[index])
+            header.controlLength = self.controlSize
+            self.iovecs[index].length = self.packetSize
+        received = recvmmsg(self.icmpSocket.fileno(), self.messages, self.batchSize, socket.MSG_DONTWAIT, None)
+        if received < 0:
+            # nothing queued, or the pending error of a datagram socket
+            return []
+        packets = []
+        for index in range(received):
+            message = self.messages[index]
+            ancillary = parseAncillary(self.controls[index].raw, message.header.controlLength)
+            address = unpackAddress(self.names[index].raw)
+            packets.append((self.views[index][:message.length], ancillary, address))
+        return packets
+
+
+class PacketSocket:
+    # Same interface as BatchSocket with one system call per packet,
+    # for platforms without sendmmsg / recvmmsg
+
+    def __init__(self, icmpSocket, batchSize=BATCH_SIZE, packetSize=1024,
+                 controlSize=icmpSession.ANCILLARY_SPACE):
+        self.icmpSocket = icmpSocket
+        self.batchSize = batchSize
+        self.packetSize = packetSize
+        self.controlSize = controlSize
+        # one slot per packet of a batch, so every view of a batch stays valid until the next one
+        self.ring = icmpSession.ReceiveRing(batchSize, packetSize)
+
+    def send(self, packets, destinationAddress):
+        sent = 0
+        for packet in packets:
+            try:
+                self.icmpSocket.sendto(packet, socket.MSG_DONTWAIT, (destinationAddress, 0))
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as error:
+                # like sendmmsg, an error after the first packet only ends the batch early
+                if error.errno != errno.ENOBUFS and not sent:
+                    raise
+                break
+            sent += 1
+        return sent
+
+    def receive(self):
+        packets = []
+        while len(packets) < self.batchSize:
+            try:
+                information, ancillary, flags, address = self.ring.receive(
+                    self.icmpSocket, self.packetSize, self.controlSize, socket.MSG_DONTWAIT)
+            except OSError:
+                break
+            packets.append((information, ancillary, address))
+        return packets
+
+
+def openBatchSocket(icmpSocket, batchSize=BATCH_SIZE):
+    if sendmmsg is None:
+        return PacketSocket(icmpSocket, batchSize)
+    return BatchSocket(icmpSocket, batchSize)
+
+
+class TokenBucket:
+    # Paces probes to rate per second: tokens trickle in continuously and each
+    # probe spends one. At most burst tokens are saved up, so a slow moment is
+    # caught up in small batches instead of one big spike.
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = 1.0
+        self.last = time.monotonic_ns()
+
+    def take(self, now, wanted):
+        # How many of wanted probes may go now
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate / 1000000000)
+        self.last = now
+        granted = min(wanted, int(self.tokens))
+        self.tokens -= granted
+        return granted
+
+    def giveBack(self, unused):
+        self.tokens += unused
+
+    def nextToken(self, now):
+        # Monotonic time in ns when the next whole token is there
+        if self.tokens >= 1:
+            return now
+        return now + int((1 - self.tokens) * 1000000000 / self.rate) + 1
+
+
+class FloodPing:
+    # Max rate ping of one host. Probes go out in batches of up to batchSize per
+    # sendmmsg, paced by a TokenBucket when a rate is given and otherwise as
+    # fast as the window and the socket buffer allow. Replies are read back in
+    # batches with recvmmsg between sends, outstanding probes sit in a
+    # ProbeWindow and a one line readout of the achieved rate and loss is
+    # refreshed every second.
+
+    def __init__(self, session, destinationAddress, rate=None, timeout=1.0, count=None, deadline=None,
+                 batchSize=BATCH_SIZE):
+        self.session = session
+        self.destinationAddress = destinationAddress
+        self.count = count
+        self.batchSize = batchSize
+        # at 100 probes per second and above a batch goes out every 10ms or so
+        self.bucket = TokenBucket(rate, min(batchSize, rate // 100)) if rate else None
+        self.window = probeWindow.ProbeWindow(timeout)
+        self.statistics = rttStatistics.RTTStatistics()
+        self.batchSocket = openBatchSocket(session.icmpSocket, batchSize)
+        self.start = time.monotonic_ns()
+        self.stopAt = None if deadline is None else self.start + int(deadline * 1000000000)
+        self.nextReport = self.start + REPORT_NS
+        self.sent = 0
+        self.sendBlocked = False
+
+    def elapsed(self, now):
+        return max(now - self.start, 1) / 1000000000
+
+    def achievedRate(self, now):
+        return self.sent / self.elapsed(now)
+
+    def sendingFinished(self, now):
+        return (self.count is not None and self.sent >= self.count) or (self.stopAt is not None and now >= self.stopAt)
+
+    def sendBatch(self, now):
+        # 1. As many probes as the bucket, the count and the window allow
+        wanted = self.batchSize
+        if self.count is not None:
+            wanted = min(wanted, self.count - self.sent)
+        if self.bucket is not None:
+            wanted = self.bucket.take(now, wanted)
+        firstProbe = self.session.sequence + 1
+        packets = []
+        while len(packets) < wanted and not self.window.slotBusy(self.session.sequence + 1):
+            sequence = self.session.nextSequence()
+            packets.append((sequence, time.monotonic_ns()))
+        if not packets:
+            return
+        # 2. One system call for the whole batch
+        probes = self.session.buildPackets(packets)
+        for attempt in range(icmpSession.SEND_ATTEMPTS):
+            try:
+                sent = self.batchSocket.send(probes, self.destinationAddress)
+                break
+            except OSError:
+                if not self.session.unprivileged or attempt == icmpSession.SEND_ATTEMPTS - 1:
+                    raise
+                # with -u the failure is the error queued by an earlier probe, read it and send again
+                self.readErrors()
+        self.sendBlocked = sent < len(packets)
+        # 3. Probes the kernel did not take are sent again later under the same numbers
+        self.session.sequence = (firstProbe + sent - 1) & 0xffffffff
+        if self.bucket is not None:
+            self.bucket.giveBack(wanted - sent)
+        for sequence, timeSent in packets[:sent]:
+            self.window.probeSent(sequence, timeSent)
+        if self.session.capture is not None:
+            self.session.capture.probesSent(self.session, probes[:sent], self.destinationAddress,
+                                            [timeSent for sequence, timeSent in packets[:sent]])
+        self.sent += sent
+
+    def readReplies(self):
+        # Everything already queued, in batches, returns how many packets were read
+        total = self.readErrors() if self.session.unprivileged else 0
+        packets = self.batchSocket.receive()
+        while packets:
+            total += len(packets)
+            for information, ancillary, address in packets:
+                self.handleReply(self.session.parsePacket(information, ancillary, address))
+            if len(packets) < self.batchSize:
+                break
+            packets = self.batchSocket.receive()
+        return total
+
+    def readErrors(self):
+        # A datagram socket keeps router errors on its error queue, where recvmmsg does not look, and
+        # stays readable until they are read. Each one answers a probe and counts as lost.
+        total = 0
+        while True:
+            try:
+                reply = self.session.receiveQueuedError()
+            except BlockingIOError:
+                return total
+            total += 1
+            self.handleReply(reply)
+
+    def handleReply(self, reply):
+        if reply is None:
+            return
+        if reply.destination != self.destinationAddress:
+            return
+        probeNumber = reply.probeNumber if reply.probeNumber is not None else self.window.unwrap(reply.sequence)
+        status, data = self.window.replyReceived(probeNumber)
+        if status not in (probeWindow.NEW, probeWindow.REORDERED):
+            return
+        if reply.icmpType != icmpSession.ICMP_ECHO_REPLY:
+            self.statistics.addLoss()
+            return
+        self.statistics.addDelay((reply.timeReceived - reply.timeSent) / 1000000)
+
+    def report(self, now):
+        answered = self.statistics.sent
+        loss = (answered - self.statistics.received) * 100.0 / answered if answered else 0.0
+        print("\r%d sent, %d received, %.2f%% loss, %.0f packets/s" %
+              (self.sent, self.statistics.received, loss, self.achievedRate(now)), end='', flush=True)
+
+    def waitTime(self, now):
+        # Seconds until the next thing to do: a token, a probe timeout, the readout or the deadline
+        if not self.sendingFinished(now) and self.bucket is None and not self.sendBlocked:
+            return 0
+        wakeUps = [self.nextReport]
+        if not self.sendingFinished(now) and self.bucket is not None:
+            wakeUps.append(self.bucket.nextToken(now))
+        nextExpiry = self.window.nextExpiry(now)
+        if nextExpiry is not None:
+            wakeUps.append(nextExpiry)
+        if self.stopAt is not None:
+            wakeUps.append(self.stopAt)
+        return max(min(wakeUps) - now, 0) / 1000000000
+
+    def run(self):
+        while True:
+            now = time.monotonic_ns()
+            # 1. Stop once every probe is answered or lost, or straight away on the deadline
+            if self.stopAt is not None and now >= self.stopAt:
+                self.statistics.addLoss(self.window.outstanding)
+                break
+            if self.sendingFinished(now) and not self.window.outstanding:
+                break
+            # 2. Send a batch, then read whatever came back meanwhile
+            if not self.sendingFinished(now):
+                self.sendBatch(now)
+            received = self.readReplies()
+            # 3. Probes whose timeout passed are lost
+            now = time.monotonic_ns()
+            for probeNumber, data in self.window.expire(now):
+                self.statistics.addLoss()
+            if now >= self.nextReport:
+                self.report(now)
+                self.nextReport += REPORT_NS * ((now - self.nextReport) // REPORT_NS + 1)
+            # 4. Block only when there is nothing to send, or the socket buffer is full
+            waitTime = self.waitTime(now)
+            if waitTime > 0 and not received:
+                select.select([self.session.icmpSocket], [self.session.icmpSocket] if self.sendBlocked else [], [],
+                              waitTime)
+        self.report(time.monotonic_ns())
+        print()
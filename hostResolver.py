@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+import concurrent.futures
+import json
+import os
+import socket
+import time
+
+# how long an answer is trusted, failures are retried sooner
+CACHE_TTL = 300
+NEGATIVE_TTL = 60
+THREADS = 32
+CACHE_FILE = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                          'networkApplications', 'resolver.json')
+
+
+def addressFamily(address):
+    return socket.AF_INET6 if ':' in address else socket.AF_INET
+
+
+def isAddress(hostname):
+    try:
+        socket.inet_pton(addressFamily(hostname), hostname)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def lookupAddresses(hostname):
+    # Runs on a pool thread: every IPv4 and IPv6 address of hostname in the order
+    # the system prefers them, an empty list if it does not resolve
+    try:
+        answers = socket.getaddrinfo(hostname, None, socket.AF_UNSPEC, socket.SOCK_RAW)
+    except (socket.gaierror, UnicodeError):
+        return []
+    addresses = []
+    for family, kind, protocol, name, address in answers:
+        if family in (socket.AF_INET, socket.AF_INET6) and address[0] not in addresses:
+            addresses.append(address[0])
+    return addresses
+
+
+def pickAddress(addresses, family=None):
+    # The first address of family, or the first of any family when family is None
+    for address in addresses:
+        if family is None or addressFamily(address) == family:
+            return address
+    return None
+
+
+class HostResolver:
+    # Resolves hostnames on a thread pool through getaddrinfo, so thousands of
+    # lookups overlap instead of queueing behind each other. A name is looked up
+    # once for both address families, callers pick the family they want.
+    # Answers (and failures, for a shorter time) go into a cache with an expiry
+    # time that is written to a JSON snapshot on close and read back by the
+    # next run.
+    #
+    #   with HostResolver() as resolver:
+    #       for hostname, address in resolver.resolveMany(hostnames):
+    #           ...
+    #
+    # A caller with its own work to do between answers, like a sweep reading
+    # replies, passes block=False and gets None whenever no answer is in yet.
+
+    def __init__(self, threads=THREADS, ttl=CACHE_TTL, cacheFile=CACHE_FILE):
+        self.threads = threads
+        self.ttl = ttl
+        self.cacheFile = cacheFile
+        # hostname -> ([addresses], expiry as a Unix time)
+        self.cache = {}
+        self.changed = False
+        self.pool = None
+        self.load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        self.save()
+
+    def load(self):
+        # A missing or broken snapshot just means starting with an empty cache
+        if not self.cacheFile:
+            return
+        try:
+            with open(self.cacheFile) as snapshot:
+                entries = json.load(snapshot)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for hostname, entry in entries.items():
+            if isinstance(entry, list) and len(entry) == 2 and isinstance(entry[0], list) and entry[1] > now:
+                self.cache[hostname] = (entry[0], entry[1])
+
+    def save(self):
+        if not self.cacheFile or not self.changed:
+            return
+        now = time.time()
+        entries = {hostname: entry for hostname, entry in self.cache.items() if entry[1] > now}
+        # Write a new file and rename it over the old one, so a concurrent run never reads half a snapshot
+        try:
+            os.makedirs(os.path.dirname(self.cacheFile), exist_ok=True)
+            temporaryFile = '%s.%d' % (self.cacheFile, os.getpid())
+            with open(temporaryFile, 'w') as snapshot:
+                json.dump(entries, snapshot)
+            os.replace(temporaryFile, self.cacheFile)
+        except OSError:
+            return
+        self.changed = False
+
+    def cached(self, hostname):
+        # (True, [addresses]) for a fresh cache entry or an address literal, (False, None) otherwise
+        if isAddress(hostname):
+            return True, [hostname]
+        entry = self.cache.get(hostname)
+        if entry is None or entry[1] <= time.time():
+            return False, None
+        return True, entry[0]
+
+    def remember(self, hostname, addresses):
+        self.cache[hostname] = (addresses, time.time() + (self.ttl if addresses else NEGATIVE_TTL))
+        self.changed = True
+
+    def resolveAll(self, hostname):
+        # Every address of hostname, raises socket.gaierror when the name does not resolve
+        found, addresses = self.cached(hostname)
+        if not found:
+            addresses = lookupAddresses(hostname)
+            self.remember(hostname, addresses)
+        if not addresses:
+            raise socket.gaierror(socket.EAI_NONAME, 'cannot resolve %s' % (hostname))
+        return addresses
+
+    def resolve(self, hostname, family=socket.AF_INET):
+        # Drop in for socket.gethostbyname (family None takes the preferred address of either family)
+        address = pickAddress(self.resolveAll(hostname), family)
+        if address is None:
+            raise socket.gaierror(socket.EAI_ADDRFAMILY, 'no %s address for %s' % (
+                'IPv6' if family == socket.AF_INET6 else 'IPv4', hostname))
+        return address
+
+    def resolveMany(self, hostnames, family=socket.AF_INET, block=True):
+        # Yields (hostname, address or None) in the order answers come in. hostnames is read lazily,
+        # cached names and literals come straight back and the caller can start probing them while
+        # at most a few batches of lookups per thread are in flight. Without block a lookup is never
+        # waited for: None is yielded instead and the caller asks again when it is ready to.
+        if self.pool is None:
+            self.pool = concurrent.futures.ThreadPoolExecutor(self.threads)
+        hostnames = iter(hostnames)
+        pending = {}
+        moreHostnames = True
+        while moreHostnames or pending:
+            # 1. Hand out lookups until the pool has enough queued
+            while moreHostnames and len(pending) < self.threads * 4:
+                try:
+                    hostname = next(hostnames)
+                except StopIteration:
+                    moreHostnames = False
+                    break
+                found, addresses = self.cached(hostname)
+                if found:
+                    yield hostname, pickAddress(addresses, family)
+                else:
+                    pending[self.pool.submit(lookupAddresses, hostname)] = hostname
+            if not pending:
+                continue
+            # 2. Pass on every answer that is in, caching it on the way
+            done, notDone = concurrent.futures.wait(pending, None if block else 0,
+                                                    concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                yield None
+            for future in done:
+                hostname = pending.pop(future)
+                addresses = future.result()
+                self.remember(hostname, addresses)
+                yield hostname, pickAddress(addresses, family)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+import array
+import socket
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Up to this many bytes the plain sum of the 16 bit words cannot pass 32 bits,
+# so the original's "& 0xffffffff" after every word never changes anything
+EXACT_SUM_LIMIT = 2 * 65537
+
+
+def finishChecksum(onesComplementSum):
+    # The last steps of the original NetworkApplication.checksum: complement,
+    # swap the two bytes and htons, so results stay bit for bit the same
+    answer = ~onesComplementSum & 0xffff
+    answer = answer >> 8 | (answer << 8 & 0xff00)
+    return socket.htons(answer)
+
+
+def foldSum(wordSum):
+    # Fold a 32 bit sum of 16 bit words into 16 bits with end around carry
+    wordSum = (wordSum >> 16) + (wordSum & 0xffff)
+    return (wordSum + (wordSum >> 16)) & 0xffff
+
+
+def wordSum(dataToChecksum):
+    # Sum of the little endian 16 bit words (a trailing odd byte counts as is), modulo 2^32
+    # frombytes, a memoryview handed to the constructor would be read as a list of single bytes
+    words = array.array('H')
+    words.frombytes(dataToChecksum[:len(dataToChecksum) & ~1])
+    if sys.byteorder == 'big':
+        words.byteswap()
+    total = sum(words)
+    if len(dataToChecksum) & 1:
+        total += dataToChecksum[-1]
+    return total & 0xffffffff
+
+
+def checksum(dataToChecksum):
+    # Same result as the original two bytes at a time loop, computed in bulk.
+    # Read as one little endian integer the buffer is sum(word_i * 65536^i), and
+    # 65536 = 1 mod 0xffff, so the integer modulo 0xffff is the ones complement
+    # sum of the words - one C level pass instead of a Python step per word.
+    if len(dataToChecksum) > EXACT_SUM_LIMIT:
+        return finishChecksum(foldSum(wordSum(dataToChecksum)))
+    residue = int.from_bytes(dataToChecksum, 'little') % 0xffff
+    if residue == 0:
+        # end around carry gives 0xffff for any non zero multiple of 0xffff, 0 only for all zero bytes
+        residue = 0xffff if any(dataToChecksum) else 0
+    return finishChecksum(residue)
+
+
+def checksumBatch(packets):
+    # Checksums of N packets of the same length, one numpy pass over all of them
+    # when numpy is installed, packet by packet otherwise
+    if numpy is None or len(packets) < 2:
+        return [checksum(packet) for packet in packets]
+    length = len(packets[0])
+    data = numpy.frombuffer(b''.join(packets), dtype=numpy.uint8).reshape(len(packets), length)
+    # 1. Plain sums of the little endian words, the odd trailing byte on its own
+    total = data[:, 0:length & ~1].view('<u2').sum(axis=1, dtype=numpy.uint64)
+    if length & 1:
+        total += data[:, -1]
+    total &= 0xffffffff
+    # 2. Fold and finish exactly as finishChecksum does
+    total = (total >> 16) + (total & 0xffff)
+    total = (total + (total >> 16)) & 0xffff
+    answer = ~total & 0xffff
+    answer = answer >> 8 | (answer << 8 & 0xff00)
+    if sys.byteorder == 'little':
+        answer = answer >> 8 | (answer << 8 & 0xff00)
+    return answer.astype(numpy.uint16).tolist()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+import socket
+import struct
+
+import packetBuilder
+
+ICMP_ECHO_REPLY = 0
+ICMP_DESTINATION_UNREACHABLE = 3
+ICMP_REDIRECT = 5
+ICMP_ECHO_REQUEST = 8
+ICMP_TIME_EXCEEDED = 11
+ICMP_PARAMETER_PROBLEM = 12
+# destination unreachable code for "fragmentation needed and DF set"
+ICMP_FRAGMENTATION_NEEDED = 4
+
+# type, code, checksum and the two halves of the rest of the header, in network byte order
+ICMP_HEADER = packetBuilder.ICMP_HEADER
+# the first 8 bytes of a quoted UDP or TCP header: ports, then length and checksum (UDP) or sequence (TCP)
+PORTS_AND_WORD = struct.Struct("!HHI")
+IPV4_HEADER_SIZE = packetBuilder.IPV4_HEADER.size
+
+# what a message says about the probe it answers
+REPLY = 'reply'                 # the destination itself answered
+TRANSIT = 'transit'             # a router on the way dropped the probe, the destination is further on
+UNREACHABLE = 'unreachable'     # the probe cannot get to the destination at all
+REDIRECTED = 'redirected'       # the probe was forwarded, the router suggests a better first hop
+
+KINDS = {
+    ICMP_ECHO_REPLY: REPLY,
+    ICMP_DESTINATION_UNREACHABLE: UNREACHABLE,
+    ICMP_REDIRECT: REDIRECTED,
+    ICMP_TIME_EXCEEDED: TRANSIT,
+    ICMP_PARAMETER_PROBLEM: UNREACHABLE,
+}
+
+# RFC 792, RFC 1122 and RFC 1812 codes
+DESCRIPTIONS = {
+    ICMP_ECHO_REPLY: {0: 'Echo Reply'},
+    ICMP_DESTINATION_UNREACHABLE: {
+        0: 'Destination Net Unreachable',
+        1: 'Destination Host Unreachable',
+        2: 'Destination Protocol Unreachable',
+        3: 'Destination Port Unreachable',
+        4: 'Fragmentation Needed and DF Set',
+        5: 'Source Route Failed',
+        6: 'Destination Net Unknown',
+        7: 'Destination Host Unknown',
+        8: 'Source Host Isolated',
+        9: 'Destination Net Prohibited',
+        10: 'Destination Host Prohibited',
+        11: 'Destination Net Unreachable for Type of Service',
+        12: 'Destination Host Unreachable for Type of Service',
+        13: 'Communication Administratively Prohibited',
+        14: 'Host Precedence Violation',
+        15: 'Precedence Cutoff in Effect',
+    },
+    ICMP_REDIRECT: {
+        0: 'Redirect Network',
+        1: 'Redirect Host',
+        2: 'Redirect Type of Service and Network',
+        3: 'Redirect Type of Service and Host',
+    },
+    ICMP_TIME_EXCEEDED: {
+        0: 'Time to Live Exceeded',
+        1: 'Fragment Reassembly Time Exceeded',
+    },
+    ICMP_PARAMETER_PROBLEM: {
+        0: 'Parameter Problem',
+        1: 'Parameter Problem: Missing a Required Option',
+        2: 'Parameter Problem: Bad Length',
+    },
+}
+
+# ICMPv6 replies carry the ICMPv4 type of the same meaning but keep their own codes (RFC 4443)
+DESCRIPTIONS_V6 = {
+    ICMP_DESTINATION_UNREACHABLE: {
+        0: 'No Route to Destination',
+        1: 'Communication Administratively Prohibited',
+        2: 'Beyond Scope of Source Address',
+        3: 'Address Unreachable',
+        4: 'Port Unreachable',
+        5: 'Source Address Failed Ingress/Egress Policy',
+        6: 'Reject Route to Destination',
+        ICMP_FRAGMENTATION_NEEDED: 'Packet Too Big',
+    },
+    ICMP_TIME_EXCEEDED: {
+        0: 'Hop Limit Exceeded',
+        1: 'Fragment Reassembly Time Exceeded',
+    },
+    ICMP_PARAMETER_PROBLEM: {
+        0: 'Erroneous Header Field',
+        1: 'Unrecognized Next Header Type',
+        2: 'Unrecognized IPv6 Option',
+    },
+}
+
+
+def describe(icmpType, icmpCode, family=socket.AF_INET):
+    # Human readable name of a type and code, as ping and traceroute print them
+    codes = (DESCRIPTIONS_V6 if family == socket.AF_INET6 else {}).get(icmpType) or DESCRIPTIONS.get(icmpType, {})
+    return codes.get(icmpCode, 'ICMP type %d code %d' % (icmpType, icmpCode))
+
+
+def messageKind(icmpType):
+    return KINDS.get(icmpType)
+
+
+class QuotedDatagram:
+    # The IP header and first bytes of the packet an error message is about,
+    # enough to tell which of our probes (ICMP, UDP or TCP) caused it
+    __slots__ = ('protocol', 'source', 'destination', 'ttl', 'icmpType', 'identifier', 'sequence',
+                 'sourcePort', 'destinationPort', 'payloadOffset')
+
+    def __init__(self, protocol, source, destination, ttl):
+        self.protocol = protocol
+        self.source = source
+        self.destination = destination
+        # what was left of the TTL when the error was sent
+        self.ttl = ttl
+        # quoted ICMP: type, identifier and sequence; quoted UDP and TCP: ports (and TCP sequence)
+        self.icmpType = None
+        self.identifier = None
+        self.sequence = None
+        self.sourcePort = None
+        self.destinationPort = None
+        # where the quoted transport payload starts, None when nothing of it was quoted
+        self.payloadOffset = None
+
+    def __repr__(self):
+        return 'QuotedDatagram(%s)' % (', '.join('%s=%r' % (name, getattr(self, name)) for name in self.__slots__))
+
+
+class ICMPMessage:
+    # One decoded ICMPv4 message. identifier and sequence belong to echo replies,
+    # mtu to fragmentation needed, gateway to redirects, pointer to parameter
+    # problems and quoted to every error message.
+    __slots__ = ('icmpType', 'icmpCode', 'kind', 'identifier', 'sequence', 'mtu', 'gateway', 'pointer', 'quoted',
+                 'payloadOffset')
+
+    def __init__(self, icmpType, icmpCode, identifier=None, sequence=None, mtu=None, gateway=None, pointer=None,
+                 quoted=None, payloadOffset=None):
+        self.icmpType = icmpType
+        self.icmpCode = icmpCode
+        self.kind = KINDS[icmpType]
+        self.identifier = identifier
+        self.sequence = sequence
+        self.mtu = mtu
+        self.gateway = gateway
+        self.pointer = pointer
+        self.quoted = quoted
+        # where the echoed data of a reply (or the quoted probe payload of an error) starts
+        self.payloadOffset = payloadOffset
+
+    def description(self):
+        return describe(self.icmpType, self.icmpCode)
+
+    def __repr__(self):
+        return 'ICMPMessage(%s)' % (', '.join('%s=%r' % (name, getattr(self, name)) for name in self.__slots__))
+
+
+def decodeQuotedICMP(view, offset, quoted):
+    quoted.icmpType, code, checksum, quoted.identifier, quoted.sequence = ICMP_HEADER.unpack_from(view, offset)
+
+
+def decodeQuotedUDP(view, offset, quoted):
+    quoted.sourcePort, quoted.destinationPort, lengthAndChecksum = PORTS_AND_WORD.unpack_from(view, offset)
+
+
+def decodeQuotedTCP(view, offset, quoted):
+    quoted.sourcePort, quoted.destinationPort, quoted.sequence = PORTS_AND_WORD.unpack_from(view, offset)
+
+
+# quoted transport protocol -> decoder of its first 8 bytes, which every error carries
+QUOTED_DECODERS = {
+    socket.IPPROTO_ICMP: decodeQuotedICMP,
+    socket.IPPROTO_UDP: decodeQuotedUDP,
+    socket.IPPROTO_TCP: decodeQuotedTCP,
+}
+
+
+def decodeQuoted(view, offset):
+    # 1. The quoted IPv4 header, its own IHL says where the transport header starts
+    if len(view) < offset + IPV4_HEADER_SIZE or view[offset] >> 4 != 4:
+        return None
+    protocol = view[offset + 9]
+    quoted = QuotedDatagram(protocol, socket.inet_ntoa(view[offset + 12:offset + 16]),
+                            socket.inet_ntoa(view[offset + 16:offset + 20]), view[offset + 8])
+    offset += (view[offset] & 0x0f) << 2
+    # 2. The first 8 bytes of the transport header, if they were quoted and we know the protocol
+    decoder = QUOTED_DECODERS.get(protocol)
+    if decoder is not None and len(view) >= offset + 8:
+        decoder(view, offset, quoted)
+        quoted.payloadOffset = offset + 8
+    return quoted
+
+
+def decodeEchoReply(view, offset, icmpType, icmpCode, high, low):
+    return ICMPMessage(icmpType, icmpCode, identifier=high, sequence=low, payloadOffset=offset + ICMP_HEADER.size)
+
+
+def decodeError(view, offset, icmpType, icmpCode, high, low):
+    quoted = decodeQuoted(view, offset + ICMP_HEADER.size)
+    if quoted is None:
+        return None
+    return ICMPMessage(icmpType, icmpCode, quoted=quoted, payloadOffset=quoted.payloadOffset)
+
+
+def decodeDestinationUnreachable(view, offset, icmpType, icmpCode, high, low):
+    message = decodeError(view, offset, icmpType, icmpCode, high, low)
+    # fragmentation needed carries the next hop MTU in the low half of the unused word (RFC 1191)
+    if message is not None and icmpCode == ICMP_FRAGMENTATION_NEEDED:
+        message.mtu = low
+    return message
+
+
+def decodeRedirect(view, offset, icmpType, icmpCode, high, low):
+    message = decodeError(view, offset, icmpType, icmpCode, high, low)
+    if message is not None:
+        message.gateway = socket.inet_ntoa(view[offset + 4:offset + 8])
+    return message
+
+
+def decodeParameterProblem(view, offset, icmpType, icmpCode, high, low):
+    message = decodeError(view, offset, icmpType, icmpCode, high, low)
+    if message is not None:
+        # octet of the quoted datagram the problem was found in
+        message.pointer = high >> 8
+    return message
+
+
+# ICMP type -> decoder, every other type is ignored
+MESSAGE_DECODERS = {
+    ICMP_ECHO_REPLY: decodeEchoReply,
+    ICMP_DESTINATION_UNREACHABLE: decodeDestinationUnreachable,
+    ICMP_REDIRECT: decodeRedirect,
+    ICMP_TIME_EXCEEDED: decodeError,
+    ICMP_PARAMETER_PROBLEM: decodeParameterProblem,
+}
+
+
+def decodeMessage(view, offset=0):
+    # The ICMPv4 message starting at offset of a buffer (bytes or a memoryview), None if it is
+    # truncated or of a type nobody asked about
+    if len(view) < offset + ICMP_HEADER.size:
+        return None
+    icmpType, icmpCode, checksum, high, low = ICMP_HEADER.unpack_from(view, offset)
+    decoder = MESSAGE_DECODERS.get(icmpType)
+    if decoder is None:
+        return None
+    return decoder(view, offset, icmpType, icmpCode, high, low)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+import ctypes
+import socket
+import struct
+
+SO_ATTACH_FILTER = getattr(socket, 'SO_ATTACH_FILTER', 26)
+
+# struct sock_filter: code, jump if true, jump if false, constant
+SOCK_FILTER = struct.Struct("=HBBI")
+# struct sock_fprog: number of instructions, pointer to them
+SOCK_FPROG = struct.Struct("@HP")
+
+# classic BPF opcodes used below
+LDX_B_MSH = 0xb1    # X = 4 * (packet[k] & 0xf)
+LD_B_IND = 0x50     # A = packet[X + k] (byte)
+LD_H_IND = 0x48     # A = packet[X + k] (halfword, network order)
+JEQ_K = 0x15        # if A == k jump jt else jf
+AND_K = 0x54        # A &= k
+LSH_K = 0x64        # A <<= k
+ADD_X = 0x0c        # A += X
+TAX = 0x07          # X = A
+RET_K = 0x06        # accept k bytes of the packet, 0 drops it
+
+ACCEPT = 0x40000
+
+
+def buildFilter(ID):
+    # Program for a raw IPv4 ICMP socket, where the packet starts at the IP header.
+    # It keeps echo replies carrying our identifier, and Time Exceeded, Destination
+    # Unreachable and Parameter Problem messages whose quoted datagram is one of
+    # our echo requests. Everything else is dropped in the kernel before it wakes
+    # us up.
+    program = [
+        # 0. X = IPv4 header length, A = ICMP type
+        (LDX_B_MSH, 0, 0, 0),
+        (LD_B_IND, 0, 0, 0),
+        # 2. Echo reply goes to 6, time exceeded, unreachable and parameter problem to 8, anything else is dropped
+        (JEQ_K, 3, 0, 0),
+        (JEQ_K, 4, 0, 11),
+        (JEQ_K, 3, 0, 3),
+        (JEQ_K, 2, 14, 12),
+        # 6. Echo reply: identifier must be ours
+        (LD_H_IND, 0, 0, 4),
+        (JEQ_K, 11, 12, ID),
+        # 8. Error: the quoted datagram must be ICMP
+        (LD_B_IND, 0, 0, 8 + 9),
+        (JEQ_K, 0, 10, socket.IPPROTO_ICMP),
+        # 10. X = outer header length + quoted header length
+        (LD_B_IND, 0, 0, 8),
+        (AND_K, 0, 0, 0x0f),
+        (LSH_K, 0, 0, 2),
+        (ADD_X, 0, 0, 0),
+        (TAX, 0, 0, 0),
+        # 15. The quoted ICMP message must be an echo request with our identifier
+        (LD_B_IND, 0, 0, 8),
+        (JEQ_K, 0, 3, 8),
+        (LD_H_IND, 0, 0, 8 + 4),
+        (JEQ_K, 0, 1, ID),
+        # 19. Accept
+        (RET_K, 0, 0, ACCEPT),
+        # 20. Drop
+        (RET_K, 0, 0, 0),
+    ]
+    return b''.join(SOCK_FILTER.pack(*instruction) for instruction in program)
+
+
+def attachFilter(icmpSocket, ID):
+    # 1. Hand the program to the kernel, it copies it so the buffer only has to live for the call
+    program = buildFilter(ID)
+    instructions = ctypes.create_string_buffer(program, len(program))
+    fprog = SOCK_FPROG.pack(len(program) // SOCK_FILTER.size, ctypes.addressof(instructions))
+    icmpSocket.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+    # 2. Packets queued before the filter was attached were not filtered, throw them away
+    while True:
+        try:
+            icmpSocket.recv(1024, socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            break
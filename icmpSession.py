@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+import os
+import select
+import socket
+import struct
+import time
+
+import icmpDecoder
+import icmpFilter
+import packetBuilder
+
+# the ICMPv4 types and codes live with their decoders
+ICMP_ECHO_REPLY = icmpDecoder.ICMP_ECHO_REPLY
+ICMP_DESTINATION_UNREACHABLE = icmpDecoder.ICMP_DESTINATION_UNREACHABLE
+ICMP_REDIRECT = icmpDecoder.ICMP_REDIRECT
+ICMP_ECHO_REQUEST = icmpDecoder.ICMP_ECHO_REQUEST
+ICMP_TIME_EXCEEDED = icmpDecoder.ICMP_TIME_EXCEEDED
+ICMP_PARAMETER_PROBLEM = icmpDecoder.ICMP_PARAMETER_PROBLEM
+ICMP_FRAGMENTATION_NEEDED = icmpDecoder.ICMP_FRAGMENTATION_NEEDED
+
+ICMPV6_DESTINATION_UNREACHABLE = 1
+ICMPV6_PACKET_TOO_BIG = 2
+ICMPV6_TIME_EXCEEDED = 3
+ICMPV6_PARAMETER_PROBLEM = 4
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+# ICMPv6 types reported as their ICMPv4 counterparts, so callers handle both families alike
+ICMPV6_TYPES = {
+    ICMPV6_ECHO_REPLY: ICMP_ECHO_REPLY,
+    ICMPV6_DESTINATION_UNREACHABLE: ICMP_DESTINATION_UNREACHABLE,
+    ICMPV6_PACKET_TOO_BIG: ICMP_DESTINATION_UNREACHABLE,
+    ICMPV6_TIME_EXCEEDED: ICMP_TIME_EXCEEDED,
+    ICMPV6_PARAMETER_PROBLEM: ICMP_PARAMETER_PROBLEM,
+}
+IPV6_HEADER_SIZE = 40
+
+# header layouts and the echo payload are shared with everything else that builds packets
+ICMP_HEADER = packetBuilder.ICMP_HEADER
+ECHO_PAYLOAD = packetBuilder.ECHO_PAYLOAD
+PAYLOAD_MAGIC = packetBuilder.PAYLOAD_MAGIC
+
+# Linux socket options the socket module does not export
+IP_RECVERR = getattr(socket, 'IP_RECVERR', 11)
+IP_RECVTTL = getattr(socket, 'IP_RECVTTL', 12)
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35)
+IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+IP_PMTUDISC_DO = getattr(socket, 'IP_PMTUDISC_DO', 2)
+IPV6_RECVERR = getattr(socket, 'IPV6_RECVERR', 25)
+IPV6_RECVHOPLIMIT = getattr(socket, 'IPV6_RECVHOPLIMIT', 51)
+IPV6_HOPLIMIT = getattr(socket, 'IPV6_HOPLIMIT', 52)
+IPV6_MTU_DISCOVER = getattr(socket, 'IPV6_MTU_DISCOVER', 23)
+IPV6_PMTUDISC_DO = 2
+ICMP6_FILTER = 1
+SO_EE_ORIGIN_ICMP6 = 3
+SO_EE_ORIGIN_ICMP = 2
+# ee_errno, ee_origin, ee_type, ee_code, ee_pad, ee_info, ee_data followed by the offender address
+SOCK_EXTENDED_ERR = struct.Struct("=IBBBBII")
+SOCKADDR_IN = struct.Struct("=HH4s8x")
+SOCKADDR_IN6 = struct.Struct("=HHI16sI")
+# struct icmp6_filter: one bit per ICMPv6 type, a set bit blocks the type
+ICMP6_FILTER_BITS = struct.Struct("=8I")
+CMSG_INT = struct.Struct("=i")
+# struct timespec carried by SCM_TIMESTAMPNS (same value as SO_TIMESTAMPNS)
+TIMESPEC = struct.Struct("@ll")
+TIMESTAMP_SPACE = socket.CMSG_SPACE(TIMESPEC.size)
+# ancillary data of a normal read: the reply TTL (datagram sockets only) and the kernel timestamp
+ANCILLARY_SPACE = socket.CMSG_SPACE(CMSG_INT.size) + TIMESTAMP_SPACE
+
+# IPv4 echo requests are never smaller than IPv4 header + ICMP header + payload
+MINIMUM_PROBE_SIZE = 20 + ICMP_HEADER.size + ECHO_PAYLOAD.size
+# what a normal read asks for, enough for any reply to a default sized probe
+RECEIVE_SIZE = 1024
+# receive buffers kept by a session, a packet read into one stays readable for this many reads
+RING_SLOTS = 64
+# tries per probe on a datagram socket, which fails one send for each error queued by an earlier probe
+SEND_ATTEMPTS = 3
+
+# timeReceived is the kernel receive time on the time.monotonic_ns() clock, timeSent,
+# probeNumber (the 32 bit sequence) and target come from the echoed payload and are
+# None when the reply did not carry it. mtu is the next hop MTU of a fragmentation
+# needed error. ICMPv6 replies carry the ICMPv4 type of the same meaning (Packet
+# Too Big shows up as fragmentation needed) and their own ICMPv6 code.
+class ICMPReply:
+    # A plain record with __slots__, no per instance dict, as many of them are
+    # made as replies come in
+    __slots__ = ('icmpType', 'icmpCode', 'ID', 'sequence', 'address', 'packetLength', 'ttl', 'timeReceived',
+                 'timeSent', 'probeNumber', 'target', 'mtu', 'destination')
+
+    def __init__(self, icmpType, icmpCode, ID, sequence, address, packetLength, ttl, timeReceived,
+                 timeSent, probeNumber, target, mtu=None, destination=None):
+        self.icmpType = icmpType
+        self.icmpCode = icmpCode
+        self.ID = ID
+        self.sequence = sequence
+        self.address = address
+        self.packetLength = packetLength
+        self.ttl = ttl
+        self.timeReceived = timeReceived
+        self.timeSent = timeSent
+        self.probeNumber = probeNumber
+        self.target = target
+        self.mtu = mtu
+        self.destination = destination
+
+    def __repr__(self):
+        return 'ICMPReply(%s)' % (', '.join('%s=%r' % (name, getattr(self, name)) for name in self.__slots__))
+
+
+def readPayload(information, offset, sequence):
+    # Errors may quote only 8 bytes of the probe, and the payload has to belong to this sequence
+    if len(information) - offset < ECHO_PAYLOAD.size:
+        return None, None, None
+    magic, timeSent, probeNumber, target = ECHO_PAYLOAD.unpack_from(information, offset)
+    if magic != PAYLOAD_MAGIC or probeNumber & 0xffff != sequence:
+        return None, None, None
+    return timeSent, probeNumber, target
+
+
+def ancillaryTTL(ancillary):
+    # TTL (IPv4) or hop limit (IPv6) of the packet, 0 when the socket does not report it
+    for level, kind, data in ancillary:
+        if (level, kind) in ((socket.IPPROTO_IP, socket.IP_TTL), (socket.IPPROTO_IPV6, IPV6_HOPLIMIT)):
+            return CMSG_INT.unpack_from(data)[0]
+    return 0
+
+
+def icmp6Filter(*allowedTypes):
+    words = [0xffffffff] * 8
+    for icmpType in allowedTypes:
+        words[icmpType >> 5] &= ~(1 << (icmpType & 31))
+    return ICMP6_FILTER_BITS.pack(*words)
+
+
+def receiveTime(ancillary):
+    # 1. Use the time the kernel stamped on the packet, not when Python got round to reading it
+    for level, kind, data in ancillary:
+        if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+            seconds, nanoseconds = TIMESPEC.unpack_from(data)
+            # 2. The stamp is wall clock time, move it onto the monotonic clock probes are sent with
+            return seconds * 1000000000 + nanoseconds - (time.time_ns() - time.monotonic_ns())
+    # 3. Without a kernel stamp fall back to the time of reading
+    return time.monotonic_ns()
+
+
+def parseIPv4Reply(information, address, timeReceived, identifier=None):
+    # An IPv4 packet, IP header included, as the ICMPReply to one of the echo requests sent with
+    # identifier (any identifier when it is None), None when it is about something else.
+    # Reads straight out of the buffer through a memoryview, nothing is sliced or copied.
+    # 1. Skip the IPv4 header, its length is in the low nibble of the first byte
+    view = memoryview(information)
+    length = len(view)
+    if length < 20:
+        return None
+    ipHeaderLength = (view[0] & 0x0f) << 2
+    # 2. Decode the message by its type, errors together with the datagram they quote
+    message = icmpDecoder.decodeMessage(view, ipHeaderLength)
+    if message is None or message.kind == icmpDecoder.REDIRECTED:
+        # a redirect says nothing about the probe, it was forwarded all the same
+        return None
+    if message.kind == icmpDecoder.REPLY:
+        icmpPacketID, icmpSeqNumber, destination = message.identifier, message.sequence, address[0]
+    else:
+        # errors are about one of our probes only if they quote an echo request
+        quoted = message.quoted
+        if quoted.protocol != socket.IPPROTO_ICMP or quoted.icmpType != ICMP_ECHO_REQUEST:
+            return None
+        icmpPacketID, icmpSeqNumber, destination = quoted.identifier, quoted.sequence, quoted.destination
+    # 3. Check the identifier, anything else belongs to another process
+    if identifier is not None and icmpPacketID != identifier:
+        return None
+    timeSent, probeNumber, target = readPayload(view, message.payloadOffset, icmpSeqNumber)
+    if timeSent is None and message.kind == icmpDecoder.REPLY:
+        return None
+    return ICMPReply(message.icmpType, message.icmpCode, icmpPacketID, icmpSeqNumber, address[0],
+                     length - ipHeaderLength, view[8], timeReceived, timeSent, probeNumber, target, message.mtu,
+                     destination)
+
+
+def parseIPv6Reply(information, address, ttl, timeReceived, identifier=None):
+    # The same for ICMPv6
+    # 1. information starts at the ICMPv6 header, as a raw ICMPv6 socket reads it
+    if len(information) < ICMP_HEADER.size:
+        return None
+    icmpType, icmpCode, icmpChecksum, icmpPacketID, icmpSeqNumber = ICMP_HEADER.unpack_from(information)
+    payloadStart = ICMP_HEADER.size
+    mtu = None
+    destination = address[0]
+    # 2. Errors quote the IPv6 header and as much of the probe as fits in the minimum MTU
+    if icmpType in (ICMPV6_DESTINATION_UNREACHABLE, ICMPV6_PACKET_TOO_BIG, ICMPV6_TIME_EXCEEDED,
+                    ICMPV6_PARAMETER_PROBLEM):
+        quotedStart = ICMP_HEADER.size + IPV6_HEADER_SIZE
+        # the quoted next header has to be ICMPv6 itself, probes carry no extension headers
+        if len(information) < quotedStart + ICMP_HEADER.size or \
+                information[ICMP_HEADER.size + 6] != socket.IPPROTO_ICMPV6:
+            return None
+        if icmpType == ICMPV6_PACKET_TOO_BIG:
+            mtu = (icmpPacketID << 16) | icmpSeqNumber
+            icmpCode = ICMP_FRAGMENTATION_NEEDED
+        quotedType, quotedCode, quotedChecksum, icmpPacketID, icmpSeqNumber = ICMP_HEADER.unpack_from(
+            information, quotedStart)
+        if quotedType != ICMPV6_ECHO_REQUEST:
+            return None
+        payloadStart = quotedStart + ICMP_HEADER.size
+        # the quoted destination address is the last 16 bytes of the quoted IPv6 header
+        destination = socket.inet_ntop(socket.AF_INET6, information[quotedStart - 16:quotedStart])
+    elif icmpType != ICMPV6_ECHO_REPLY:
+        return None
+    # 3. Check the identifier, anything else belongs to another process
+    if identifier is not None and icmpPacketID != identifier:
+        return None
+    timeSent, probeNumber, target = readPayload(information, payloadStart, icmpSeqNumber)
+    if timeSent is None and icmpType == ICMPV6_ECHO_REPLY:
+        return None
+    return ICMPReply(ICMPV6_TYPES[icmpType], icmpCode, icmpPacketID, icmpSeqNumber, address[0],
+                     len(information), ttl, timeReceived, timeSent, probeNumber, target, mtu, destination)
+
+
+class ReceiveRing:
+    # Preallocated receive buffers used round robin. recvmsg_into reads each
+    # packet into the next slot and the caller gets a memoryview of the bytes
+    # received, so no bytes object is made per packet. A view stays valid until
+    # its slot comes round again, slots reads later.
+
+    def __init__(self, slots=RING_SLOTS, slotSize=RECEIVE_SIZE):
+        self.slots = slots
+        self.slotSize = 0
+        self.next = 0
+        self.allocate(slotSize)
+
+    def allocate(self, slotSize):
+        # New buffers rather than resized ones, views handed out earlier keep their old buffers alive
+        self.slotSize = slotSize
+        self.views = [memoryview(bytearray(slotSize)) for slot in range(self.slots)]
+
+    def receive(self, icmpSocket, size, ancillarySize, flags=0):
+        # Same as icmpSocket.recvmsg(size, ancillarySize, flags), with a view in place of the bytes
+        if size > self.slotSize:
+            self.allocate(size)
+        view = self.views[self.next]
+        self.next = (self.next + 1) % self.slots
+        length, ancillary, flags, address = icmpSocket.recvmsg_into((view[:size],), ancillarySize, flags)
+        return view[:length], ancillary, flags, address
+
+
+class ICMPSession:
+    # One ICMP socket shared by every probe of a run. Replies are told apart by
+    # the per-process identifier and a sequence number that only goes up.
+    #
+    # With unprivileged=True a datagram ICMP socket is used instead of a raw one
+    # (Linux, needs the group in net.ipv4.ping_group_range). The kernel then owns
+    # the identifier, only hands us replies to our own probes, strips the IP
+    # header and delivers ICMP errors through the socket error queue.
+    #
+    # family=socket.AF_INET6 speaks ICMPv6 instead. The kernel fills in the
+    # ICMPv6 checksum and never returns the IPv6 header, the hop limit comes
+    # with the ancillary data.
+
+    def __init__(self, unprivileged=False, family=socket.AF_INET, capture=None):
+        self.unprivileged = unprivileged
+        self.family = family
+        self.sequence = 0
+        # the TTL probes go out with, None while it is the system default
+        self.ttl = None
+        # a pcapWriter.PcapWriter that sees every probe and every packet read, or None
+        self.capture = capture
+        self.receiveSize = RECEIVE_SIZE
+        self.ring = ReceiveRing()
+        if family == socket.AF_INET6:
+            self.openICMPv6Socket(unprivileged)
+        elif unprivileged:
+            # 1. Create a datagram ICMP socket, the kernel rewrites the identifier to the bound port
+            self.icmpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            self.icmpSocket.bind(('', 0))
+            self.ID = self.icmpSocket.getsockname()[1]
+            # 2. Ask for the TTL of replies and for ICMP errors on the error queue
+            self.icmpSocket.setsockopt(socket.IPPROTO_IP, IP_RECVTTL, 1)
+            self.icmpSocket.setsockopt(socket.IPPROTO_IP, IP_RECVERR, 1)
+        else:
+            # 1. Create the ICMP socket once, looking the protocol number up only once
+            self.icmpSocket = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+            # 2. Use the process id as identifier so concurrent runs do not steal each other's replies
+            self.ID = os.getpid() & 0xffff
+            # 3. Let the kernel drop every ICMP packet that is not about our probes
+            try:
+                icmpFilter.attachFilter(self.icmpSocket, self.ID)
+            except OSError:
+                pass
+        # 4. Have the kernel timestamp every received packet so RTTs leave out our own scheduling delay
+        self.icmpSocket.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        # 5. Every probe starts from the same prebuilt echo request
+        if family == socket.AF_INET6:
+            self.template = packetBuilder.EchoTemplate(ICMPV6_ECHO_REQUEST, self.ID, withChecksum=False)
+        else:
+            self.template = packetBuilder.EchoTemplate(ICMP_ECHO_REQUEST, self.ID)
+
+    def openICMPv6Socket(self, unprivileged):
+        if unprivileged:
+            # 1. Datagram ICMPv6 socket, the kernel owns the identifier and queues errors for us
+            self.icmpSocket = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM, socket.IPPROTO_ICMPV6)
+            self.icmpSocket.bind(('', 0))
+            self.ID = self.icmpSocket.getsockname()[1]
+            self.icmpSocket.setsockopt(socket.IPPROTO_IPV6, IPV6_RECVERR, 1)
+        else:
+            # 1. Raw ICMPv6 socket, let only echo replies and the errors that quote probes through
+            self.icmpSocket = socket.socket(socket.AF_INET6, socket.SOCK_RAW, socket.IPPROTO_ICMPV6)
+            self.ID = os.getpid() & 0xffff
+            self.icmpSocket.setsockopt(socket.IPPROTO_ICMPV6, ICMP6_FILTER, icmp6Filter(
+                ICMPV6_ECHO_REPLY, ICMPV6_DESTINATION_UNREACHABLE, ICMPV6_PACKET_TOO_BIG, ICMPV6_TIME_EXCEEDED,
+                ICMPV6_PARAMETER_PROBLEM))
+        # 2. There is no IPv6 header to read the hop limit from, ask for it as ancillary data
+        self.icmpSocket.setsockopt(socket.IPPROTO_IPV6, IPV6_RECVHOPLIMIT, 1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def fileno(self):
+        return self.icmpSocket.fileno()
+
+    def close(self):
+        self.icmpSocket.close()
+
+    def setTTL(self, TTL):
+        self.ttl = TTL
+        if self.family == socket.AF_INET6:
+            self.icmpSocket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_UNICAST_HOPS, TTL)
+        else:
+            self.icmpSocket.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, TTL)
+
+    def setDontFragment(self):
+        # Set DF on every probe, probes over the known path MTU then fail with EMSGSIZE instead of fragmenting
+        if self.family == socket.AF_INET6:
+            self.icmpSocket.setsockopt(socket.IPPROTO_IPV6, IPV6_MTU_DISCOVER, IPV6_PMTUDISC_DO)
+        else:
+            self.icmpSocket.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+
+    def nextSequence(self):
+        # 32 bit probe counter, the ICMP header carries its low 16 bits
+        self.sequence = (self.sequence + 1) & 0xffffffff
+        return self.sequence
+
+    def buildPacket(self, sequence, timeSent, target=0, padding=0):
+        # An echo request of its own, for callers that keep packets around
+        return bytes(self.template.build(sequence, timeSent, target, padding))
+
+    def buildPackets(self, probes):
+        # Echo requests for a list of (sequence, timeSent), each with its own copy of the bytes
+        build = self.template.build
+        return [bytes(build(sequence, timeSent)) for sequence, timeSent in probes]
+
+    def sendOnePing(self, destinationAddress, target=0, size=None):
+        # target is any 32 bit index the caller wants back in the reply,
+        # size the length of the whole IP datagram (default: as small as possible)
+        sequence = self.nextSequence()
+        ipHeaderSize = IPV6_HEADER_SIZE if self.family == socket.AF_INET6 else 20
+        padding = max(size - ipHeaderSize - ICMP_HEADER.size - ECHO_PAYLOAD.size, 0) if size else 0
+        # Send time in nanoseconds on the monotonic clock, it travels in the payload
+        timeSent = time.monotonic_ns()
+        packet = self.template.build(sequence, timeSent, target, padding)
+        # a raw IPv6 socket takes the port as protocol number, 0 means its own
+        port = 0 if self.family == socket.AF_INET6 else 1
+        for attempt in range(SEND_ATTEMPTS):
+            try:
+                self.icmpSocket.sendto(packet, (destinationAddress, port))
+                break
+            except OSError:
+                # with -u this is the error an earlier probe queued, reported once and then cleared.
+                # It stays on the error queue for the reply reader, the probe is sent again.
+                if not self.unprivileged or attempt == SEND_ATTEMPTS - 1:
+                    raise
+        if self.capture is not None:
+            self.capture.probeSent(self, packet, destinationAddress, timeSent)
+        return sequence & 0xffff, timeSent
+
+    def parseReply(self, information, address, timeReceived):
+        return parseIPv4Reply(information, address, timeReceived, self.ID)
+
+    def parseReplyV6(self, information, ancillary, address):
+        return parseIPv6Reply(information, address, ancillaryTTL(ancillary), receiveTime(ancillary), self.ID)
+
+    def receiveQueuedError(self):
+        # The next ICMP error on a datagram socket's error queue as an ICMPReply (None when it is not about
+        # an echo request), raises BlockingIOError once the queue is empty. Reading the last queued error
+        # also clears the pending error the socket would otherwise fail its next send with.
+        # 1. ICMP errors for our probes wait on the error queue, apart from the replies
+        information, ancillary, flags, address = self.ring.receive(
+            self.icmpSocket, self.receiveSize, socket.CMSG_SPACE(CMSG_INT.size) + TIMESTAMP_SPACE +
+            socket.CMSG_SPACE(SOCK_EXTENDED_ERR.size + SOCKADDR_IN6.size),
+            socket.MSG_ERRQUEUE | socket.MSG_DONTWAIT)
+        extendedError = None
+        for level, kind, data in ancillary:
+            if (level, kind) in ((socket.IPPROTO_IP, IP_RECVERR), (socket.IPPROTO_IPV6, IPV6_RECVERR)):
+                extendedError = data
+        if extendedError is None or len(information) < ICMP_HEADER.size:
+            return None
+        errno, origin, icmpType, icmpCode, pad, info, extra = SOCK_EXTENDED_ERR.unpack_from(extendedError)
+        # 2. The queued packet is our own probe, the router that answered is the offender
+        mtu = None
+        if origin == SO_EE_ORIGIN_ICMP:
+            offender = socket.inet_ntoa(SOCKADDR_IN.unpack_from(extendedError, SOCK_EXTENDED_ERR.size)[2])
+        elif origin == SO_EE_ORIGIN_ICMP6 and icmpType in ICMPV6_TYPES:
+            offender = socket.inet_ntop(socket.AF_INET6,
+                                        SOCKADDR_IN6.unpack_from(extendedError, SOCK_EXTENDED_ERR.size)[3])
+        else:
+            return None
+        # 3. The capture rebuilds the error as it came, before ICMPv6 types are mapped to their ICMP names
+        if self.capture is not None:
+            if origin == SO_EE_ORIGIN_ICMP6:
+                tooBig = icmpType == ICMPV6_PACKET_TOO_BIG
+            else:
+                tooBig = icmpType == ICMP_DESTINATION_UNREACHABLE and icmpCode == ICMP_FRAGMENTATION_NEEDED
+            self.capture.errorReceived(self, information, ancillary, offender, address[0], icmpType, icmpCode,
+                                       info if tooBig else 0)
+        if origin == SO_EE_ORIGIN_ICMP6:
+            if icmpType == ICMPV6_PACKET_TOO_BIG:
+                icmpCode = ICMP_FRAGMENTATION_NEEDED
+            icmpType = ICMPV6_TYPES[icmpType]
+        icmpPacketID, icmpSeqNumber = ICMP_HEADER.unpack_from(information)[3:]
+        timeSent, probeNumber, target = readPayload(information, ICMP_HEADER.size, icmpSeqNumber)
+        # for fragmentation needed (or packet too big) the kernel puts the next hop MTU in ee_info
+        if icmpType == ICMP_DESTINATION_UNREACHABLE and icmpCode == ICMP_FRAGMENTATION_NEEDED:
+            mtu = info
+        # the address of an error queue read is where the probe was going
+        return ICMPReply(icmpType, icmpCode, icmpPacketID, icmpSeqNumber, offender, len(information),
+                         ancillaryTTL(ancillary), receiveTime(ancillary), timeSent, probeNumber, target, mtu,
+                         address[0])
+
+    def receiveDatagramReply(self):
+        # 1. ICMP errors for our probes wait on the error queue, check it first
+        try:
+            return self.receiveQueuedError()
+        except BlockingIOError:
+            pass
+        # 2. Otherwise read the echo reply, the kernel has already stripped the IP header
+        try:
+            information, ancillary, flags, address = self.ring.receive(
+                self.icmpSocket, self.receiveSize, ANCILLARY_SPACE, socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return None
+        except OSError:
+            # the error that went on the queue is also reported once as a pending socket error
+            return None
+        return self.parsePacket(information, ancillary, address)
+
+    def parseDatagramReply(self, information, ancillary, address):
+        icmpType, icmpCode, icmpChecksum, icmpPacketID, icmpSeqNumber = ICMP_HEADER.unpack_from(information)
+        timeSent, probeNumber, target = readPayload(information, ICMP_HEADER.size, icmpSeqNumber)
+        if icmpType not in (ICMP_ECHO_REPLY, ICMPV6_ECHO_REPLY) or timeSent is None:
+            return None
+        return ICMPReply(ICMP_ECHO_REPLY, icmpCode, icmpPacketID, icmpSeqNumber, address[0], len(information),
+                         ancillaryTTL(ancillary), receiveTime(ancillary), timeSent, probeNumber, target,
+                         destination=address[0])
+
+    def parsePacket(self, information, ancillary, address):
+        # One packet however it was read (recvmsg or a batch), with the ancillary data it came with
+        if self.capture is not None:
+            self.capture.packetReceived(self, information, ancillary, address)
+        if self.unprivileged:
+            return self.parseDatagramReply(information, ancillary, address)
+        if self.family == socket.AF_INET6:
+            return self.parseReplyV6(information, ancillary, address)
+        return self.parseReply(information, address, receiveTime(ancillary))
+
+    def receiveOnePing(self, timeout):
+        # Wait up to timeout seconds for the next packet addressed to this session
+        # (a timeout of 0 only takes what is already queued on the socket)
+        deadline = time.monotonic() + timeout
+        while True:
+            whatReady = select.select([self.icmpSocket], [], [], max(deadline - time.monotonic(), 0))
+            if not whatReady[0]:
+                return None
+            if self.unprivileged:
+                reply = self.receiveDatagramReply()
+            else:
+                information, ancillary, flags, address = self.ring.receive(
+                    self.icmpSocket, self.receiveSize, ANCILLARY_SPACE)
+                reply = self.parsePacket(information, ancillary, address)
+            if reply is not None:
+                return reply
+            if time.monotonic() >= deadline:
+                return None
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+import collections
+import time
+
+import floodPing
+import icmpSession
+import probeWindow
+
+# how many probes go out before the socket is drained again
+SEND_BURST = 64
+# while the next target is still resolving, replies are read for this long before looking again
+TARGET_POLL_NS = 10000000
+
+MultiPingResult = collections.namedtuple('MultiPingResult', 'target address delay reply')
+
+
+class MultiPing:
+    # fping style engine: one ICMPSession sends interleaved echo requests to every
+    # target without waiting for answers. Outstanding probes sit in a ProbeWindow
+    # keyed by probe number (the identifier is the session's), so each reply finds
+    # its target and the window's timer wheel expires the ones that never get an
+    # answer. Results are yielded as they happen, so a run over N targets takes
+    # about N sends plus one timeout. With a rate (probes per second) sends are
+    # paced by a token bucket, so a sweep of a big network stays polite.
+
+    def __init__(self, session, timeout=1.0, windowSize=probeWindow.WINDOW_SIZE, rate=None):
+        self.session = session
+        self.window = probeWindow.ProbeWindow(timeout, windowSize)
+        self.bucket = floodPing.TokenBucket(rate, min(SEND_BURST, rate // 100)) if rate else None
+        self.targetIndex = 0
+
+    def sendProbe(self, target, address):
+        # The send time and target index travel in the payload, the window only remembers who to report
+        sequence, timeSent = self.session.sendOnePing(address, self.targetIndex)
+        self.targetIndex = (self.targetIndex + 1) & 0xffffffff
+        # session.sequence is the full 32 bit number of the probe just sent
+        self.window.probeSent(self.session.sequence, timeSent, (target, address))
+
+    def probeNumber(self, reply):
+        # Routers quoting only 8 bytes leave us the 16 bit sequence to unwrap
+        if reply.probeNumber is not None:
+            return reply.probeNumber
+        return self.window.unwrap(reply.sequence)
+
+    def matchReply(self, reply):
+        # 1. Look the probe up by its number, the reply must be about a probe to that target
+        probeNumber = self.probeNumber(reply)
+        entry = self.window.probeData(probeNumber)
+        if entry is None:
+            return None
+        target, address = entry
+        if reply.destination != address:
+            return None
+        # 2. Only the first answer before the timeout counts, the window counts the rest
+        status, entry = self.window.replyReceived(probeNumber)
+        if status not in (probeWindow.NEW, probeWindow.REORDERED):
+            return None
+        if reply.icmpType != icmpSession.ICMP_ECHO_REPLY:
+            return MultiPingResult(target, address, None, reply)
+        return MultiPingResult(target, address, (reply.timeReceived - reply.timeSent) / 1000000, reply)
+
+    def drainReplies(self, waitTime):
+        # Results for every reply already queued, the first one waited for up to waitTime seconds
+        reply = self.session.receiveOnePing(waitTime)
+        while reply is not None:
+            result = self.matchReply(reply)
+            if result is not None:
+                yield result
+            reply = self.session.receiveOnePing(0)
+
+    def windowFree(self):
+        # Never push a probe that is still waiting for its reply out of the window
+        return not self.window.slotBusy(self.session.sequence + 1)
+
+    def run(self, targets):
+        # targets is any iterable of (target, address) pairs, it is only read as fast as probes go out.
+        # A None in it means the next target is not known yet, replies are read meanwhile.
+        targets = iter(targets)
+        moreTargets = True
+        while moreTargets or self.window.outstanding:
+            targetReady = True
+            # 1. Send the next burst of probes, interleaved over all targets, as far as the rate allows
+            burst = SEND_BURST if self.bucket is None else self.bucket.take(time.monotonic_ns(), SEND_BURST)
+            sent = 0
+            while moreTargets and sent < burst and self.windowFree():
+                try:
+                    nextTarget = next(targets)
+                except StopIteration:
+                    moreTargets = False
+                    break
+                if nextTarget is None:
+                    targetReady = False
+                    break
+                target, address = nextTarget
+                try:
+                    self.sendProbe(target, address)
+                except OSError:
+                    yield MultiPingResult(target, address, None, None)
+                sent += 1
+            if self.bucket is not None:
+                self.bucket.giveBack(burst - sent)
+
+            # 2. Drain every reply already waiting, block only when there is nothing left to send
+            now = time.monotonic_ns()
+            wakeUps = [self.window.nextExpiry(now)]
+            if moreTargets and not targetReady:
+                wakeUps.append(now + TARGET_POLL_NS)
+            elif moreTargets and self.windowFree():
+                wakeUps.append(now if self.bucket is None else self.bucket.nextToken(now))
+            wakeUps = [wakeUp for wakeUp in wakeUps if wakeUp is not None]
+            yield from self.drainReplies(max(min(wakeUps) - now, 0) / 1000000000 if wakeUps else 0)
+
+            # 3. Report probes whose timeout has passed as lost
+            for probeNumber, (target, address) in self.window.expire(time.monotonic_ns()):
+                yield MultiPingResult(target, address, None, None)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+import socket
+import struct
+
+import icmpChecksum
+
+# Every header layout is compiled once here. Builders write straight into a
+# buffer the caller owns with pack_into, so building a probe allocates nothing.
+
+# version and header length, TOS, total length, identification, flags and fragment offset,
+# TTL, protocol, header checksum, source, destination
+IPV4_HEADER = struct.Struct("!BBHHHBBH4s4s")
+# type, code, checksum, identifier, sequence - packed in network byte order
+ICMP_HEADER = struct.Struct("!BBHHH")
+# source port, destination port, length, checksum
+UDP_HEADER = struct.Struct("!HHHH")
+# source port, destination port, sequence, acknowledgement, data offset, flags, window, checksum, urgent pointer
+TCP_HEADER = struct.Struct("!HHIIBBHHH")
+# source, destination, zero, protocol, length - what UDP and TCP checksums cover besides their own bytes
+PSEUDO_HEADER = struct.Struct("!4s4sBBH")
+CHECKSUM_FIELD = struct.Struct("!H")
+# echo payload: magic, monotonic send time in ns, 32 bit sequence, target index.
+# The reply echoes it back, so the RTT and the target come out of the reply itself.
+ECHO_PAYLOAD = struct.Struct("!4sQII")
+# header and payload together, an echo request is written with one pack_into
+ECHO_PACKET = struct.Struct("!BBHHH4sQII")
+PAYLOAD_MAGIC = b'PgTg'
+
+IPV4_VERSION_IHL = 0x45
+IP_DONT_FRAGMENT = 0x4000
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+
+def internetChecksum(data):
+    # RFC 1071 checksum of data (bytes, bytearray or memoryview), ready to pack with "!H"
+    return socket.htons(icmpChecksum.checksum(data))
+
+
+def transportChecksum(buffer, offset, length, protocol, source, destination):
+    # UDP and TCP checksums also cover a pseudo header with the IP addresses
+    pseudoHeader = PSEUDO_HEADER.pack(socket.inet_aton(source), socket.inet_aton(destination), 0, protocol, length)
+    return internetChecksum(pseudoHeader + memoryview(buffer)[offset:offset + length])
+
+
+def packIPv4Header(buffer, offset, source, destination, protocol, payloadLength, ttl=64, identification=0,
+                   dontFragment=False):
+    # A 20 byte IPv4 header without options, header checksum included
+    IPV4_HEADER.pack_into(buffer, offset, IPV4_VERSION_IHL, 0, IPV4_HEADER.size + payloadLength, identification,
+                          IP_DONT_FRAGMENT if dontFragment else 0, ttl, protocol, 0,
+                          socket.inet_aton(source), socket.inet_aton(destination))
+    CHECKSUM_FIELD.pack_into(buffer, offset + 10, internetChecksum(memoryview(buffer)[offset:offset + IPV4_HEADER.size]))
+    return IPV4_HEADER.size
+
+
+def packICMPHeader(buffer, offset, icmpType, icmpCode, identifier, sequence, payloadLength=0):
+    # The checksum covers the payloadLength bytes the caller already put after the header
+    ICMP_HEADER.pack_into(buffer, offset, icmpType, icmpCode, 0, identifier, sequence)
+    length = ICMP_HEADER.size + payloadLength
+    CHECKSUM_FIELD.pack_into(buffer, offset + 2, internetChecksum(memoryview(buffer)[offset:offset + length]))
+    return ICMP_HEADER.size
+
+
+def packUDPHeader(buffer, offset, sourcePort, destinationPort, payloadLength=0, source=None, destination=None):
+    # Without the IP addresses the checksum is left at 0, which IPv4 allows for UDP
+    length = UDP_HEADER.size + payloadLength
+    UDP_HEADER.pack_into(buffer, offset, sourcePort, destinationPort, length, 0)
+    if source is not None and destination is not None:
+        udpChecksum = transportChecksum(buffer, offset, length, socket.IPPROTO_UDP, source, destination)
+        # a computed 0 goes on the wire as 0xffff, 0 means no checksum (RFC 768)
+        CHECKSUM_FIELD.pack_into(buffer, offset + 6, udpChecksum or 0xffff)
+    return UDP_HEADER.size
+
+
+def packTCPHeader(buffer, offset, sourcePort, destinationPort, sequence, acknowledgement=0, flags=TCP_SYN,
+                  window=65535, payloadLength=0, source=None, destination=None):
+    # A 20 byte TCP header without options, checksummed when the IP addresses are given
+    TCP_HEADER.pack_into(buffer, offset, sourcePort, destinationPort, sequence, acknowledgement,
+                         (TCP_HEADER.size // 4) << 4, flags, window, 0, 0)
+    if source is not None and destination is not None:
+        tcpChecksum = transportChecksum(buffer, offset, TCP_HEADER.size + payloadLength, socket.IPPROTO_TCP,
+                                        source, destination)
+        CHECKSUM_FIELD.pack_into(buffer, offset + 16, tcpChecksum)
+    return TCP_HEADER.size
+
+
+class EchoTemplate:
+    # A prebuilt echo request. Type, code, magic and the zero padding never
+    # change, so their part of the checksum is summed once here; a probe only
+    # brings new identifier, sequence, send time and target words. Per RFC 1624
+    # (eqn. 3, HC' = ~(~HC + ~m + m')) with the changing words all zero in the
+    # template, the new checksum is ~(constant sum + new words), and because
+    # 2^16 = 1 mod 0xffff the new words can be added as whole 16, 32 and 64 bit
+    # integers. Building a probe is a few integer operations and one pack_into
+    # into a buffer that is reused for every probe.
+
+    def __init__(self, icmpType, identifier, withChecksum=True):
+        self.icmpType = icmpType
+        self.identifier = identifier
+        # ICMPv6 checksums are the kernel's job, they stay 0
+        self.withChecksum = withChecksum
+        # ones complement sum of the words that are the same in every probe
+        self.constantSum = (icmpType << 8) + int.from_bytes(PAYLOAD_MAGIC, 'big')
+        self.buffer = bytearray(ECHO_PACKET.size)
+        self.view = memoryview(self.buffer)
+
+    def checksum(self, identifier, sequence, timeSent, target):
+        if not self.withChecksum:
+            return 0
+        remainder = (self.constantSum + identifier + (sequence & 0xffff) + timeSent + (sequence << 32 | target)) % 0xffff
+        # the constant words are never all zero, so a remainder of 0 means a folded sum of 0xffff
+        return 0xffff - remainder if remainder else 0
+
+    def packInto(self, buffer, offset, sequence, timeSent, target=0):
+        # Write the header and payload of probe sequence into any writable buffer
+        ECHO_PACKET.pack_into(buffer, offset, self.icmpType, 0,
+                              self.checksum(self.identifier, sequence, timeSent, target),
+                              self.identifier, sequence & 0xffff, PAYLOAD_MAGIC, timeSent, sequence, target)
+
+    def build(self, sequence, timeSent, target=0, padding=0):
+        # The probe as a memoryview of the template's own buffer, only valid until the next build
+        length = ECHO_PACKET.size + padding
+        if length > len(self.buffer):
+            # padding bytes are zero and add nothing to the checksum, they only need room
+            self.buffer = bytearray(length)
+            self.view = memoryview(self.buffer)
+        self.packInto(self.buffer, 0, sequence, timeSent, target)
+        return self.view[:length]
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+import errno
+import socket
+import time
+
+import icmpSession
+
+# probe sizes sent at once per destination and round
+PARALLEL_PROBES = 8
+# Linux: the MTU of the route to a connected socket
+IP_MTU = getattr(socket, 'IP_MTU', 14)
+DEFAULT_MTU = 1500
+MAXIMUM_PACKET_SIZE = 65535
+# socket receive buffer, room for a round of the largest replies
+RECEIVE_BUFFER = 4 * 1024 * 1024
+
+# how a probe size turned out
+FITS = 'fits'
+TOO_BIG = 'too big'
+NO_REPLY = 'no reply'
+
+
+def routeMTU(destinationAddress):
+    # Upper bound for the search: the MTU of the interface the route leaves through
+    probeSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        probeSocket.connect((destinationAddress, 9))
+        return probeSocket.getsockopt(socket.IPPROTO_IP, IP_MTU)
+    except OSError:
+        return DEFAULT_MTU
+    finally:
+        probeSocket.close()
+
+
+class PathMTUSearch:
+    # k-ary search for the largest IP datagram that reaches one destination with
+    # DF set. Every round probes up to PARALLEL_PROBES sizes spread evenly over
+    # what is still unknown, so 1500 bytes are settled in three or four RTTs.
+    # Fragmentation needed errors move the upper bound straight to the MTU they
+    # report, so the next round usually probes the answer itself.
+
+    def __init__(self, target, address, highest, parallel=PARALLEL_PROBES):
+        self.target = target
+        self.address = address
+        self.parallel = parallel
+        # low fits (once confirmed), high is the largest size that still may
+        self.low = icmpSession.MINIMUM_PROBE_SIZE
+        self.high = max(min(highest, MAXIMUM_PACKET_SIZE), self.low)
+        self.confirmed = False
+        self.unreachable = False
+        self.rounds = 0
+        self.events = []
+
+    def finished(self):
+        return self.unreachable or (self.low >= self.high and self.confirmed)
+
+    def reachable(self):
+        return self.confirmed
+
+    def pathMTU(self):
+        return self.low if self.confirmed else None
+
+    def nextSizes(self):
+        # The sizes to probe this round, always including the current upper bound
+        self.rounds += 1
+        if not self.confirmed and self.low >= self.high:
+            return [self.low]
+        if self.high - self.low <= self.parallel:
+            sizes = list(range(self.low + 1, self.high + 1))
+        else:
+            sizes = [self.low + (self.high - self.low) * step // self.parallel for step in range(1, self.parallel + 1)]
+        if not self.confirmed:
+            # nothing has come back yet, also check the destination answers at all
+            sizes[0] = self.low
+        return sizes
+
+    def probeResult(self, size, outcome, mtu=None):
+        if outcome == FITS:
+            self.low = max(self.low, size)
+            self.high = max(self.high, self.low)
+            self.confirmed = True
+        elif outcome == TOO_BIG:
+            self.high = min(self.high, size - 1)
+            if mtu:
+                self.high = min(self.high, mtu)
+        # 1. The bound can only drop below low when the path changed under us
+        if self.high < self.low:
+            self.low = self.high = max(self.high, icmpSession.MINIMUM_PROBE_SIZE)
+
+    def roundOver(self, outcomes):
+        # Sizes above the largest one that fitted and without any answer are taken as too big (a black hole)
+        largestFit = max((size for size, outcome in outcomes.items() if outcome == FITS), default=None)
+        for size, outcome in outcomes.items():
+            if outcome == NO_REPLY and (largestFit is not None and size > largestFit or self.confirmed):
+                self.probeResult(size, TOO_BIG)
+        if largestFit is None and not self.confirmed and all(outcome == NO_REPLY for outcome in outcomes.values()):
+            # not even the smallest probe came back, give up on this destination
+            self.unreachable = True
+
+
+class PathMTUDiscovery:
+    # Runs a PathMTUSearch for every destination over one ICMP session, all
+    # searches step their rounds together so many destinations cost no more
+    # round trips than one.
+
+    def __init__(self, session, timeout=1.0, parallel=PARALLEL_PROBES):
+        self.session = session
+        self.timeout = timeout
+        self.parallel = parallel
+        self.session.setDontFragment()
+        # replies of the largest probes have to fit in the receive buffer, and a whole round of them in the socket
+        self.session.receiveSize = 65535
+        self.session.icmpSocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+
+    def sendRound(self, searches):
+        # Returns {sequence: (search, size)} and {search: {size: outcome}}
+        probes = {}
+        outcomes = {}
+        for index, search in enumerate(searches):
+            outcomes[search] = {}
+            for size in search.nextSizes():
+                try:
+                    sequence, timeSent = self.session.sendOnePing(search.address, index, size)
+                except OSError as error:
+                    if error.errno != errno.EMSGSIZE:
+                        raise
+                    # the kernel already knows the path MTU is smaller
+                    outcomes[search][size] = TOO_BIG
+                    search.probeResult(size, TOO_BIG)
+                    continue
+                outcomes[search][size] = NO_REPLY
+                probes[sequence] = (search, size)
+        return probes, outcomes
+
+    def collectReplies(self, probes, outcomes):
+        # Wait until every probe of the round is answered or the timeout passes
+        deadline = time.monotonic() + self.timeout
+        unanswered = len(probes)
+        while unanswered:
+            reply = self.session.receiveOnePing(max(deadline - time.monotonic(), 0))
+            if reply is None:
+                return
+            entry = probes.get(reply.sequence)
+            if entry is None:
+                continue
+            search, size = entry
+            if reply.destination != search.address:
+                continue
+            if reply.icmpType == icmpSession.ICMP_ECHO_REPLY:
+                outcome = FITS
+            elif reply.mtu is not None:
+                outcome = TOO_BIG
+                search.events.append((reply.address, reply.mtu))
+            else:
+                continue
+            if outcomes[search][size] == NO_REPLY:
+                unanswered -= 1
+            outcomes[search][size] = outcome
+            search.probeResult(size, outcome, reply.mtu)
+
+    def run(self, targets):
+        # targets is a list of (target, address), yields each finished PathMTUSearch
+        searches = [PathMTUSearch(target, address, routeMTU(address), self.parallel) for target, address in targets]
+        while searches:
+            probes, outcomes = self.sendRound(searches)
+            self.collectReplies(probes, outcomes)
+            remaining = []
+            for search in searches:
+                search.roundOver(outcomes[search])
+                if search.finished():
+                    yield search
+                else:
+                    remaining.append(search)
+            searches = remaining
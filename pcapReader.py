@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+import mmap
+import struct
+
+import pcapWriter
+
+PCAP_MAGIC_MICROSECONDS = 0xa1b2c3d4
+PCAP_MAGIC_NANOSECONDS = pcapWriter.PCAP_MAGIC_NANOSECONDS
+PCAPNG_MAGIC = 0x0a0d0d0a
+GLOBAL_HEADER_SIZE = pcapWriter.GLOBAL_HEADER.size
+RECORD_HEADER_SIZE = pcapWriter.RECORD_HEADER.size
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = pcapWriter.LINKTYPE_RAW
+# DLT_RAW as some systems write it into files
+LINKTYPE_RAW_DLT = 12
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_VLAN = (0x8100, 0x88a8)
+ETHERNET_HEADER_SIZE = 14
+VLAN_TAG_SIZE = 4
+LINUX_SLL_HEADER_SIZE = 16
+LINUX_SLL2_HEADER_SIZE = 20
+ETHERTYPE = struct.Struct("!H")
+
+
+def rawOffset(frame):
+    # Packets start at the IP header
+    return 0
+
+
+def ethernetOffset(frame):
+    # 1. Skip the addresses and any VLAN tags, 2. only IP frames are of interest
+    offset = ETHERNET_HEADER_SIZE
+    etherType = ETHERTYPE.unpack_from(frame, offset - 2)[0]
+    while etherType in ETHERTYPE_VLAN and len(frame) >= offset + VLAN_TAG_SIZE:
+        offset += VLAN_TAG_SIZE
+        etherType = ETHERTYPE.unpack_from(frame, offset - 2)[0]
+    return offset if etherType in (ETHERTYPE_IPV4, ETHERTYPE_IPV6) else None
+
+
+def linuxCookedOffset(frame):
+    # tcpdump -i any: the protocol is the last field of the 16 byte header
+    if ETHERTYPE.unpack_from(frame, LINUX_SLL_HEADER_SIZE - 2)[0] not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+        return None
+    return LINUX_SLL_HEADER_SIZE
+
+
+def linuxCookedV2Offset(frame):
+    # the version 2 header starts with the protocol and is 20 bytes long
+    if ETHERTYPE.unpack_from(frame, 0)[0] not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+        return None
+    return LINUX_SLL2_HEADER_SIZE
+
+
+# link type -> (shortest frame, function of a frame giving where its IP header starts or None)
+LINK_DECODERS = {
+    LINKTYPE_RAW: (0, rawOffset),
+    LINKTYPE_RAW_DLT: (0, rawOffset),
+    LINKTYPE_ETHERNET: (ETHERNET_HEADER_SIZE, ethernetOffset),
+    LINKTYPE_LINUX_SLL: (LINUX_SLL_HEADER_SIZE, linuxCookedOffset),
+    LINKTYPE_LINUX_SLL2: (LINUX_SLL2_HEADER_SIZE, linuxCookedV2Offset),
+}
+
+
+class PcapReader:
+    # Streams the IP packets of a libpcap file, as written by pcapWriter or by
+    # tcpdump, through a memory map: the file is never read in whole and every
+    # packet comes out as a memoryview into the map, so a capture of any size
+    # costs only the pages being looked at. Either byte order and microsecond or
+    # nanosecond timestamps are understood, for raw IP, Ethernet and Linux
+    # cooked captures. Raises ValueError for anything that is not such a file.
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        self.map = None
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file cannot be mapped
+            self.close()
+            raise ValueError('%s: empty file' % (filename))
+        self.view = memoryview(self.map)
+        self.readGlobalHeader()
+        # frames and bytes read so far, what the link layer was not IP is skipped
+        self.frames = 0
+        self.bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.map is not None:
+            self.view.release()
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def readGlobalHeader(self):
+        if len(self.view) < GLOBAL_HEADER_SIZE:
+            self.close()
+            raise ValueError('%s: too short for a pcap file' % (self.filename))
+        # 1. The magic number in the writer's byte order says which order the rest is in
+        for byteOrder in '<>':
+            magic = struct.unpack_from(byteOrder + 'I', self.view)[0]
+            if magic in (PCAP_MAGIC_MICROSECONDS, PCAP_MAGIC_NANOSECONDS):
+                break
+        else:
+            self.close()
+            if magic == PCAPNG_MAGIC:
+                raise ValueError('%s: pcapng files are not supported, save it as pcap' % (self.filename))
+            raise ValueError('%s: not a pcap file' % (self.filename))
+        # 2. Timestamps are kept in nanoseconds whatever the file has
+        self.timeScale = 1 if magic == PCAP_MAGIC_NANOSECONDS else 1000
+        header = struct.Struct(byteOrder + pcapWriter.GLOBAL_HEADER.format.lstrip('=@<>!'))
+        magic, major, minor, zone, sigfigs, self.snaplen, self.linkType = header.unpack_from(self.view)
+        if self.linkType not in LINK_DECODERS:
+            self.close()
+            raise ValueError('%s: link type %d is not supported' % (self.filename, self.linkType))
+        self.recordHeader = struct.Struct(byteOrder + pcapWriter.RECORD_HEADER.format.lstrip('=@<>!'))
+
+    def packets(self):
+        # Yields (wall clock time in nanoseconds, memoryview of the IP packet), up to a truncated last record
+        view = self.view
+        end = len(view)
+        unpackRecord = self.recordHeader.unpack_from
+        timeScale = self.timeScale
+        shortestFrame, linkOffset = LINK_DECODERS[self.linkType]
+        offset = GLOBAL_HEADER_SIZE
+        while offset + RECORD_HEADER_SIZE <= end:
+            seconds, fraction, capturedLength, originalLength = unpackRecord(view, offset)
+            offset += RECORD_HEADER_SIZE
+            if offset + capturedLength > end:
+                break
+            frame = view[offset:offset + capturedLength]
+            offset += capturedLength
+            self.frames += 1
+            self.bytes += capturedLength
+            if capturedLength < shortestFrame:
+                continue
+            start = linkOffset(frame)
+            if start is None:
+                continue
+            yield seconds * 1000000000 + fraction * timeScale, frame[start:] if start else frame
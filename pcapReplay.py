@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+import socket
+import struct
+
+import icmpDecoder
+import icmpSession
+import probeWindow
+import rttStatistics
+
+IPV6_HEADER_SIZE = icmpSession.IPV6_HEADER_SIZE
+# identifier and sequence of an echo request, after type, code and checksum
+ECHO_IDENTIFIER = struct.Struct("!HH")
+ECHO_IDENTIFIER_OFFSET = 4
+
+
+class ReplayHop:
+    # What came back for the probes of one TTL to one destination
+    __slots__ = ('statistics', 'errors', 'responders')
+
+    def __init__(self):
+        self.statistics = rttStatistics.RTTStatistics()
+        # delays of the errors other than time exceeded, whether they count depends on the run
+        self.errors = rttStatistics.RTTStatistics()
+        # address of whoever answered -> kind of its last answer
+        self.responders = {}
+
+
+class CaptureReplay:
+    # Rebuilds ping and traceroute results from a capture instead of the wire.
+    # Echo requests found in the capture go into a ProbeWindow per identifier,
+    # as they did on the session that sent them, and everything else is parsed
+    # by the session's own reply parsers and matched against them. Times are
+    # the capture timestamps, so the timeout wheel runs on capture time and a
+    # replay gives the same loss, late and duplicate counts however fast it runs.
+    #
+    # Results are kept per destination and probe TTL: a ping run shows up as one
+    # TTL, a traceroute as one per hop. Replies count as they did live: an echo
+    # reply or a time exceeded has a delay, any other error is a lost probe to a
+    # ping but a timed last hop to a traceroute.
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        # identifier -> ProbeWindow of the probes sent with it
+        self.windows = {}
+        # destination -> {probe TTL -> ReplayHop}
+        self.destinations = {}
+        self.packets = 0
+        self.probes = 0
+        self.replies = 0
+        self.unmatched = 0
+        self.nextExpiry = None
+
+    def hop(self, destination, ttl):
+        hops = self.destinations.get(destination)
+        if hops is None:
+            hops = self.destinations[destination] = {}
+        hop = hops.get(ttl)
+        if hop is None:
+            hop = hops[ttl] = ReplayHop()
+        return hop
+
+    def replay(self, packets):
+        # Feeds (timestamp, IP packet) pairs, as PcapReader.packets yields them
+        for timestamp, packet in packets:
+            self.packets += 1
+            if self.nextExpiry is not None and timestamp >= self.nextExpiry:
+                self.expire(timestamp)
+            length = len(packet)
+            if length < 20:
+                continue
+            version = packet[0] >> 4
+            if version == 4:
+                # 1. IPv4 ICMP, the session parser takes it with the IP header
+                if packet[9] != socket.IPPROTO_ICMP:
+                    continue
+                ipHeaderLength = (packet[0] & 0x0f) << 2
+                if length >= ipHeaderLength + icmpSession.ICMP_HEADER.size and \
+                        packet[ipHeaderLength] == icmpSession.ICMP_ECHO_REQUEST:
+                    self.probeSent(packet, ipHeaderLength, socket.inet_ntoa(packet[16:20]), packet[8], timestamp)
+                    continue
+                reply = icmpSession.parseIPv4Reply(packet, (socket.inet_ntoa(packet[12:16]), 0), timestamp)
+            elif version == 6:
+                # 2. IPv6 ICMPv6 without extension headers, the parser starts at the ICMPv6 header
+                if length < IPV6_HEADER_SIZE + icmpSession.ICMP_HEADER.size or packet[6] != socket.IPPROTO_ICMPV6:
+                    continue
+                if packet[IPV6_HEADER_SIZE] == icmpSession.ICMPV6_ECHO_REQUEST:
+                    self.probeSent(packet, IPV6_HEADER_SIZE, socket.inet_ntop(socket.AF_INET6, packet[24:40]),
+                                   packet[7], timestamp)
+                    continue
+                reply = icmpSession.parseIPv6Reply(packet[IPV6_HEADER_SIZE:],
+                                                   (socket.inet_ntop(socket.AF_INET6, packet[8:24]), 0), packet[7],
+                                                   timestamp)
+            else:
+                continue
+            if reply is not None:
+                self.replyReceived(reply)
+
+    def probeSent(self, packet, icmpOffset, destination, ttl, timestamp):
+        identifier, sequence = ECHO_IDENTIFIER.unpack_from(packet, icmpOffset + ECHO_IDENTIFIER_OFFSET)
+        # only probes carrying our payload, the reply parsers would not take the answers to anything else
+        timeSent, probeNumber, target = icmpSession.readPayload(packet, icmpOffset + icmpSession.ICMP_HEADER.size,
+                                                                sequence)
+        if probeNumber is None:
+            return
+        window = self.windows.get(identifier)
+        if window is None:
+            window = self.windows[identifier] = probeWindow.ProbeWindow(self.timeout)
+        self.probes += 1
+        window.probeSent(probeNumber, timestamp, (destination, ttl, timestamp))
+        if self.nextExpiry is None:
+            self.nextExpiry = window.nextExpiry(timestamp)
+
+    def replyReceived(self, reply):
+        self.replies += 1
+        window = self.windows.get(reply.ID)
+        if window is None:
+            self.unmatched += 1
+            return
+        # errors may quote only 8 bytes of the probe, its sequence then has to do
+        probeNumber = reply.probeNumber if reply.probeNumber is not None else window.unwrap(reply.sequence)
+        outcome, probe = window.replyReceived(probeNumber)
+        if outcome == probeWindow.UNKNOWN or probe[0] != reply.destination:
+            self.unmatched += 1
+            return
+        if outcome in (probeWindow.NEW, probeWindow.REORDERED):
+            destination, ttl, timeSent = probe
+            hop = self.hop(destination, ttl)
+            kind = icmpDecoder.messageKind(reply.icmpType)
+            hop.responders[reply.address] = kind
+            delay = (reply.timeReceived - timeSent) / 1000000
+            if kind in (icmpDecoder.REPLY, icmpDecoder.TRANSIT):
+                hop.statistics.addDelay(delay)
+            else:
+                hop.errors.addDelay(delay)
+
+    def expire(self, now):
+        # Probes whose timeout passed in capture time are lost, as the live run counted them
+        self.nextExpiry = None
+        for window in self.windows.values():
+            for probeNumber, (destination, ttl, timeSent) in window.expire(now):
+                self.hop(destination, ttl).statistics.addLoss()
+            nextExpiry = window.nextExpiry(now)
+            if nextExpiry is not None and (self.nextExpiry is None or nextExpiry < self.nextExpiry):
+                self.nextExpiry = nextExpiry
+
+    def finish(self):
+        # The capture is over, whatever is still outstanding was never answered
+        for window in self.windows.values():
+            for probeNumber, (destination, ttl, timeSent) in window.expire(1 << 63):
+                self.hop(destination, ttl).statistics.addLoss()
+        self.nextExpiry = None
+
+    def results(self):
+        # Yields (destination, [(ttl, ReplayHop)] by TTL, RTTStatistics of those hops together). Like
+        # traceroute the hops end at the first TTL that reached the destination (or a router giving up
+        # on it): a parallel trace stops reading once it has, higher TTLs were never waited for.
+        for destination, hops in self.destinations.items():
+            total = rttStatistics.RTTStatistics()
+            path = []
+            tracing = len(hops) > 1
+            for ttl, hop in sorted(hops.items()):
+                # 1. Errors settle once: a traceroute times the router that gave up, a ping lost the probe
+                if tracing:
+                    hop.statistics.merge(hop.errors)
+                else:
+                    hop.statistics.addLoss(hop.errors.received)
+                hop.errors = rttStatistics.RTTStatistics()
+                # 2. The path as far as traceroute would have gone
+                path.append((ttl, hop))
+                total.merge(hop.statistics)
+                if any(kind != icmpDecoder.TRANSIT for kind in hop.responders.values()):
+                    break
+            yield destination, path, total
+
+    def details(self):
+        # Duplicate, late and reordered replies over every window, for printAdditionalDetails
+        totals = {'duplicates': 0, 'lateReplies': 0, 'reordered': 0}
+        for window in self.windows.values():
+            for name, value in window.details().items():
+                totals[name] += value
+        return totals
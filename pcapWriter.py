@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+import socket
+import struct
+import time
+
+import icmpSession
+import packetBuilder
+
+# nanosecond resolution pcap, version 2.4, packets start at the IP header (LINKTYPE_RAW)
+PCAP_MAGIC_NANOSECONDS = 0xa1b23c4d
+PCAP_VERSION_MAJOR = 2
+PCAP_VERSION_MINOR = 4
+LINKTYPE_RAW = 101
+SNAPLEN = 65535
+# magic, version, time zone, sigfigs, snaplen, link type - in host byte order, the magic tells readers which
+GLOBAL_HEADER = struct.Struct("=IHHiIII")
+# seconds, nanoseconds, captured length, original length
+RECORD_HEADER = struct.Struct("=IIII")
+# version, traffic class and flow label, payload length, next header, hop limit, source, destination
+IPV6_HEADER = struct.Struct("!IHBB16s16s")
+# ICMPv6 pseudo header: source, destination, length, zeros and next header
+ICMPV6_PSEUDO_HEADER = struct.Struct("!16s16sI3xB")
+# records are collected in memory and written once this much is waiting
+FLUSH_SIZE = 1 << 20
+DEFAULT_TTL = 64
+
+
+def localAddress(destinationAddress):
+    # The source address the kernel picks for destinationAddress, no packet is sent
+    family = socket.AF_INET6 if ':' in destinationAddress else socket.AF_INET
+    probeSocket = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        probeSocket.connect((destinationAddress, 9))
+        return probeSocket.getsockname()[0]
+    except OSError:
+        return '::' if family == socket.AF_INET6 else '0.0.0.0'
+    finally:
+        probeSocket.close()
+
+
+def receiveStamp(ancillary):
+    # (seconds, nanoseconds) of the kernel receive stamp, wall clock time already, or of now without one
+    for level, kind, data in ancillary:
+        if kind == icmpSession.SO_TIMESTAMPNS and level == socket.SOL_SOCKET:
+            return icmpSession.TIMESPEC.unpack_from(data)
+    return divmod(time.time_ns(), 1000000000)
+
+
+class PcapWriter:
+    # Writes every probe sent and every packet received on the sessions it is
+    # given to a libpcap file with nanosecond timestamps. Records are packed
+    # into one in-memory buffer that goes to the file in large writes, so a
+    # flood run pays a dictionary lookup and two appends per packet.
+    #
+    # Raw IPv4 sockets hand us whole packets. Probes, and replies read from
+    # raw IPv6 or datagram sockets, come without an IP header; a header with
+    # the addresses, TTL and lengths the packet had is put in front of them
+    # (cached per flow, so it is built once), so the file reads like a capture
+    # taken on the wire. Errors read from a datagram socket's error queue come
+    # as our own probe plus who answered and how; the ICMP error is rebuilt
+    # around the probe, so a replay sees the same answers the live run did.
+
+    def __init__(self, filename, flushSize=FLUSH_SIZE):
+        self.filename = filename
+        self.flushSize = flushSize
+        self.file = open(filename, 'wb', buffering=0)
+        self.buffer = bytearray(GLOBAL_HEADER.pack(PCAP_MAGIC_NANOSECONDS, PCAP_VERSION_MAJOR, PCAP_VERSION_MINOR,
+                                                   0, 0, SNAPLEN, LINKTYPE_RAW))
+        self.packets = 0
+        # packets are timed on the monotonic clock, pcap wants the wall clock
+        self.clockOffset = time.time_ns() - time.monotonic_ns()
+        # destination -> our address towards it, (source, destination, length, ttl) -> IP header
+        self.localAddresses = {}
+        self.headers = {}
+        # (destination, length, session TTL) -> header of our probes, skipping the address lookup
+        self.probeHeaders = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.buffer = bytearray()
+
+    def record(self, timestamp, header, packet):
+        # One record stamped with a monotonic clock time: header (b'' when the packet has its own), then the packet
+        seconds, nanoseconds = divmod(timestamp + self.clockOffset, 1000000000)
+        self.recordAt(seconds, nanoseconds, header, packet)
+
+    def recordAt(self, seconds, nanoseconds, header, packet):
+        # The same stamped with a wall clock time, as the kernel stamps received packets
+        length = len(header) + len(packet)
+        buffer = self.buffer
+        buffer += RECORD_HEADER.pack(seconds, nanoseconds, length, length)
+        buffer += header
+        buffer += packet
+        self.packets += 1
+        if len(buffer) >= self.flushSize:
+            self.flush()
+
+    def localAddress(self, remoteAddress):
+        address = self.localAddresses.get(remoteAddress)
+        if address is None:
+            address = self.localAddresses[remoteAddress] = localAddress(remoteAddress)
+        return address
+
+    def ipHeader(self, source, destination, length, ttl):
+        # The header a packet of length bytes between source and destination had, built once per flow
+        key = (source, destination, length, ttl)
+        header = self.headers.get(key)
+        if header is None:
+            if ':' in source:
+                # link-local addresses come with a scope the header has no room for
+                header = IPV6_HEADER.pack(6 << 28, length, socket.IPPROTO_ICMPV6, ttl,
+                                          socket.inet_pton(socket.AF_INET6, source.split('%')[0]),
+                                          socket.inet_pton(socket.AF_INET6, destination.split('%')[0]))
+            else:
+                header = bytearray(packetBuilder.IPV4_HEADER.size)
+                packetBuilder.packIPv4Header(header, 0, source, destination, socket.IPPROTO_ICMP, length, ttl)
+                header = bytes(header)
+            self.headers[key] = header
+        return header
+
+    def probeHeader(self, session, destinationAddress, length):
+        # Header of a probe of length bytes to destinationAddress, one lookup once the flow is known
+        key = (destinationAddress, length, session.ttl)
+        header = self.probeHeaders.get(key)
+        if header is None:
+            header = self.probeHeaders[key] = self.ipHeader(self.localAddress(destinationAddress), destinationAddress,
+                                                            length, session.ttl or DEFAULT_TTL)
+        return header
+
+    def fillChecksumV6(self, packet, destinationAddress, sourceAddress=None):
+        # The kernel fills in ICMPv6 checksums on the way out, do the same for the copy
+        packet = bytearray(packet)
+        packetBuilder.CHECKSUM_FIELD.pack_into(packet, 2, 0)
+        sourceAddress = sourceAddress or self.localAddress(destinationAddress)
+        pseudoHeader = ICMPV6_PSEUDO_HEADER.pack(socket.inet_pton(socket.AF_INET6, sourceAddress.split('%')[0]),
+                                                 socket.inet_pton(socket.AF_INET6, destinationAddress.split('%')[0]),
+                                                 len(packet), socket.IPPROTO_ICMPV6)
+        packetBuilder.CHECKSUM_FIELD.pack_into(packet, 2, packetBuilder.internetChecksum(pseudoHeader + packet))
+        return packet
+
+    def probeSent(self, session, packet, destinationAddress, timeSent):
+        if session.family == socket.AF_INET6:
+            packet = self.fillChecksumV6(packet, destinationAddress)
+        self.record(timeSent, self.probeHeader(session, destinationAddress, len(packet)), packet)
+
+    def probesSent(self, session, packets, destinationAddress, timesSent):
+        # A batch of probes to one destination, as flood sends them
+        if session.family == socket.AF_INET6:
+            packets = [self.fillChecksumV6(packet, destinationAddress) for packet in packets]
+        if not packets:
+            return
+        header = self.probeHeader(session, destinationAddress, len(packets[0]))
+        length = len(header) + len(packets[0])
+        clockOffset = self.clockOffset
+        pack = RECORD_HEADER.pack
+        buffer = self.buffer
+        for packet, timeSent in zip(packets, timesSent):
+            seconds, nanoseconds = divmod(timeSent + clockOffset, 1000000000)
+            buffer += pack(seconds, nanoseconds, length, length)
+            buffer += header
+            buffer += packet
+        self.packets += len(packets)
+        if len(buffer) >= self.flushSize:
+            self.flush()
+
+    def packetReceived(self, session, information, ancillary, address):
+        # 1. The kernel stamp is wall clock time already, read it as is
+        seconds, nanoseconds = receiveStamp(ancillary)
+        # 2. Raw IPv4 sockets read the IP header too, the others get one made up
+        if session.family == socket.AF_INET and not session.unprivileged:
+            self.recordAt(seconds, nanoseconds, b'', information)
+            return
+        ttl = icmpSession.ancillaryTTL(ancillary) or DEFAULT_TTL
+        self.recordAt(seconds, nanoseconds,
+                      self.ipHeader(address[0], self.localAddress(address[0]), len(information), ttl), information)
+
+    def errorReceived(self, session, quoted, ancillary, offender, destinationAddress, icmpType, icmpCode, mtu):
+        # An ICMP error from a datagram socket's error queue: quoted is our probe as the offender quoted it,
+        # type and code are the family's own and mtu is the next hop MTU of a fragmentation needed or
+        # packet too big (0 otherwise)
+        seconds, nanoseconds = receiveStamp(ancillary)
+        localAddress = self.localAddress(destinationAddress)
+        # 1. The quoted datagram, our probe behind the IP header it left with
+        message = bytearray(packetBuilder.ICMP_HEADER.size)
+        message += self.ipHeader(localAddress, destinationAddress, len(quoted), session.ttl or DEFAULT_TTL)
+        message += quoted
+        # 2. The ICMP header in front, the MTU goes where both families keep it
+        packetBuilder.packICMPHeader(message, 0, icmpType, icmpCode, mtu >> 16, mtu & 0xffff,
+                                     len(message) - packetBuilder.ICMP_HEADER.size)
+        if session.family == socket.AF_INET6:
+            message = self.fillChecksumV6(message, localAddress, offender)
+        ttl = icmpSession.ancillaryTTL(ancillary) or DEFAULT_TTL
+        self.recordAt(seconds, nanoseconds, self.ipHeader(offender, localAddress, len(message), ttl), message)
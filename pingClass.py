@@ -10,6 +10,8 @@ import sys
 import struct
 import time
 
+import icmpSession
+
 
 def setupArgumentParser() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
@@ -99,81 +101,60 @@ class NetworkApplication:
 
 class ICMPPing(NetworkApplication):
 
-    def receiveOnePing(self, icmpSocket, destinationAddress, ID, timeout):
-
-        # 1. Wait for the socket to receive a reply. #2. Once received, record time of receipt, otherwise, handle a timeout
-        try:
-            information, address = icmpSocket.recvfrom(1024)
-            timeRecieved = time.time()
-            timeSent = information.split()[2]
-            
-            # 3. Compare the time of receipt to time of sending, producing the total network delay
-            timeSent= self.sendOnePing(icmpSocket, destinationAddress, 111)
-            totalNetworkDelay = (timeRecieved*1000) - timeSent
-            
-            # 4. Unpack the packet header for useful information, including the ID
-            icmpType, icmpCode, icmpChecksum, icmpPacketID, icmpSeqNumber = struct.unpack("bbHHh", icmpHeader)
-
-            # 5. Check that the ID matches between the request and reply AND THEN 6. Return total network delay
-            if(icmpPacketID == self.ID):
-                return totalNetworkDelay
-
-            else:
-                return 0
-
-        except timeout: # No response received, print the timeout message
-            print("Request timed out")
-
-
-
-    def sendOnePing(self, icmpSocket, destinationAddress, ID):
-        # 1. Build ICMP header
-        icmpHeader=struct.pack("bbHHh", 8, 0, 0, ID, 1) #8 = type code, 0s= deafault, 1= base sequence number
-
-        # 2. Checksum ICMP packet using given function
-        icmpChecksum = self.checksum(icmpHeader)
-
-        # 3. Insert checksum into packet
-        icmpHeader = struct.pack("bbHHh", 8, 0, icmpChecksum, ID, 1)
-
-        # 4. Send packet using socket- double check this //run with wireshark
-        icmpSocket.sendto(icmpHeader, (destinationAddress, 1))
-        
-        # 5. Record time of sending
-        timeSent=time.time()
-        return timeSent
+    def receiveOnePing(self, session, destinationAddress, sequence, timeout):
+        # 1. Wait for the shared socket to receive a reply, otherwise handle a timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            reply = session.receiveOnePing(deadline - time.monotonic())
+            if reply is None:
+                print("Request timed out")
+                return None
+
+            # 2. Check that the reply answers this probe, late replies to earlier probes are skipped
+            if reply.address != destinationAddress and reply.icmpType == icmpSession.ICMP_ECHO_REPLY:
+                continue
+            if reply.sequence != sequence:
+                continue
+            return reply
+
+    def sendOnePing(self, session, destinationAddress):
+        # 1. Build, checksum and send the echo request on the shared socket
+        sequence, timeSent = session.sendOnePing(destinationAddress)
+        # 2. Return the sequence number and time of sending
+        return sequence, timeSent
 
     def doOnePing(self, destinationAddress, timeout):
-        # 1. Create ICMP socket
-        # Translate an Internet protocol name (for example, 'icmp') to a constant suitable for passing as the (optional) third argument to the socket() function.
-        icmp_proto = socket.getprotobyname("icmp") #debugging
-        icmpSocket = socket.socket(socket.AF_INET, socket.SOCK_RAW, icmp_proto)
-        #icmpSocket = socket.socket(socket.AF_INET,socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        # 1. Call sendOnePing function on the socket opened for this run
+        sequence, timeSent = self.sendOnePing(self.session, destinationAddress)
 
-        # 2. Call sendOnePing function
-        timeSent = self.sendOnePing(icmpSocket, destinationAddress, 111)
+        # 2. Call receiveOnePing function
+        reply = self.receiveOnePing(self.session, destinationAddress, sequence, timeout)
+        if reply is None:
+            return None
 
-        # 3. Call receiveOnePing function
-        networkDelay = self.receiveOnePing(icmpSocket, destinationAddress, 111, 1000, timeSent)
-
-        # 4. Close ICMP socket
-        icmpSocket.close()
-
-        # 5. Return total network delay
-        return networkDelay
+        # 3. Compare the time of receipt to time of sending, producing the total network delay
+        networkDelay = (reply.timeReceived - timeSent) / 1000000
+        return networkDelay, reply
 
     def __init__(self, args):
         print('Ping to: %s...' % (args.hostname))
         # 1. Look up hostname, resolving it to an IP address
         ipAddress = socket.gethostbyname(args.hostname)
-
-        # 2. Call doOnePing function approximately every second
-        while True:
-            time.sleep(1)
-            debuggingTimeout = args.timeout
-            print("testing:", ipAddress, debuggingTimeout)
-            returnedDelay = self.doOnePing(ipAddress, debuggingTimeout)
-            # 3. Print out the returned delay (and other relevant details) using the printOneResult method
-            self.printOneResult(ipAddress, 50, returnedDelay, 150)
-            #Example use of printOneResult - complete as appropriate
-            # 4. Continue this process until stopped - did this through the while True
\ No newline at end of file
+        timeout = args.timeout or 1
+
+        # 2. Open one ICMP socket for the whole run
+        self.session = icmpSession.ICMPSession()
+        with self.session:
+            # 3. Call doOnePing function approximately every second
+            while True:
+                time.sleep(1)
+                result = self.doOnePing(ipAddress, timeout)
+                if result is None:
+                    continue
+                returnedDelay, reply = result
+                # 4. Print out the returned delay (and other relevant details) using the printOneResult method
+                if reply.icmpType != icmpSession.ICMP_ECHO_REPLY:
+                    print("From %s: icmp type=%d code=%d" % (reply.address, reply.icmpType, reply.icmpCode))
+                    continue
+                self.printOneResult(ipAddress, reply.packetLength, returnedDelay, reply.ttl)
+                # 5. Continue this process until stopped
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+import time
+
+# below this much time to go the wait is a busy poll, select() cannot sleep that precisely
+SPIN_NS = 200000
+
+
+class ProbeScheduler:
+    # Fires probes on absolute deadlines start + n * interval of the monotonic
+    # clock, so time spent sending and handling replies never shifts later
+    # probes and a long run sends exactly 1 / interval probes per second.
+    # Stops after count probes and/or once the overall deadline (seconds) passes.
+
+    def __init__(self, interval, count=None, deadline=None):
+        self.interval = int(interval * 1000000000)
+        self.count = count
+        self.start = time.monotonic_ns()
+        self.stopAt = None if deadline is None else self.start + int(deadline * 1000000000)
+        self.sent = 0
+
+    def nextProbeTime(self):
+        return self.start + self.sent * self.interval
+
+    def expired(self, now):
+        # The overall deadline has passed, nothing more is sent or waited for
+        return self.stopAt is not None and now >= self.stopAt
+
+    def finished(self, now):
+        # No more probes to send, outstanding ones may still be waited for
+        return self.expired(now) or (self.count is not None and self.sent >= self.count)
+
+    def due(self, now):
+        # True for every probe whose deadline has passed, so a late wakeup catches up
+        return not self.finished(now) and now >= self.nextProbeTime()
+
+    def probeSent(self):
+        self.sent += 1
+
+    def wakeUpTime(self, now, *otherDeadlines):
+        # Earliest of the next probe, the overall deadline and whatever else the caller waits on
+        deadlines = [deadline for deadline in otherDeadlines if deadline is not None]
+        if not self.finished(now):
+            deadlines.append(self.nextProbeTime())
+        if self.stopAt is not None:
+            deadlines.append(self.stopAt)
+        return min(deadlines) if deadlines else now
+
+    def waitTime(self, now, wakeUp):
+        # Seconds the caller may block for, 0 means poll and come straight back
+        timeLeft = wakeUp - now
+        if timeLeft <= SPIN_NS:
+            return 0
+        return (timeLeft - SPIN_NS) / 1000000000
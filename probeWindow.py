@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+
+# default window: enough slots for well over 100k probes in flight
+WINDOW_SIZE = 1 << 17
+# timer wheel: 10ms ticks, 1024 slots, so one turn of the wheel covers about 10 seconds
+TICK_NS = 10000000
+WHEEL_SLOTS = 1024
+
+# slot states
+EMPTY = 0
+OUTSTANDING = 1
+ANSWERED = 2
+EXPIRED = 3
+
+# what replyReceived makes of a reply
+NEW = 'new'
+REORDERED = 'reordered'
+DUPLICATE = 'duplicate'
+LATE = 'late'
+UNKNOWN = 'unknown'
+
+
+class TimerWheel:
+    # Hashed timer wheel: a deadline goes into slot (deadline // tick) % slots,
+    # advancing the clock only looks at the slots whose tick has passed. Adding
+    # a timer and expiring it are O(1), there is nothing to cancel - the owner
+    # just ignores timers for probes that were answered in the meantime.
+
+    def __init__(self, tick=TICK_NS, slots=WHEEL_SLOTS):
+        self.tick = tick
+        self.slots = [[] for slot in range(slots)]
+        self.currentTick = None
+        self.pending = 0
+
+    def schedule(self, deadline, key):
+        if self.currentTick is None:
+            self.currentTick = deadline // self.tick
+        self.slots[(deadline // self.tick) % len(self.slots)].append((deadline, key))
+        self.pending += 1
+
+    def advance(self, now):
+        # Returns the keys of every timer whose deadline is not after now. The wheel is
+        # settled before anything is handed out, so a caller may stop reading half way.
+        expired = []
+        if self.currentTick is None:
+            return expired
+        nowTick = now // self.tick
+        # after a long pause every slot has been passed, look at each one once
+        lastTick = min(nowTick, self.currentTick + len(self.slots) - 1)
+        for tick in range(self.currentTick, lastTick + 1):
+            slot = self.slots[tick % len(self.slots)]
+            if not slot:
+                continue
+            # timers more than one turn away share the slot and stay for a later turn
+            remaining = []
+            for deadline, key in slot:
+                if deadline <= now:
+                    self.pending -= 1
+                    expired.append(key)
+                else:
+                    remaining.append((deadline, key))
+            self.slots[tick % len(self.slots)] = remaining
+        # the current tick is only partly over, look at it again next time
+        self.currentTick = nowTick
+        return expired
+
+    def nextDeadline(self):
+        # The earliest deadline still on the wheel, None if nothing is scheduled. It may belong to a
+        # probe answered since, the caller then just finds nothing to expire.
+        if not self.pending:
+            return None
+        # 1. The first slot from the current tick on holding a timer for that very tick
+        for tick in range(self.currentTick, self.currentTick + len(self.slots)):
+            deadlines = [deadline for deadline, key in self.slots[tick % len(self.slots)]
+                         if deadline // self.tick <= tick]
+            if deadlines:
+                return min(deadlines)
+        # 2. Every timer is more than a turn away
+        return min(deadline for slot in self.slots for deadline, key in slot)
+
+
+class ProbeWindow:
+    # Sliding window of outstanding probes keyed by their 32 bit probe number.
+    # Each probe owns slot probeNumber % size of a set of flat arrays, so sending,
+    # answering and expiring a probe are all O(1) and memory is fixed however long
+    # the run is. Timeouts go through the TimerWheel instead of per probe socket
+    # timeouts. Duplicate, late (after the timeout) and reordered replies are
+    # counted separately from the normal ones.
+
+    def __init__(self, timeout, size=WINDOW_SIZE, tick=TICK_NS):
+        self.timeoutNs = int(timeout * 1000000000)
+        self.size = size
+        self.states = bytearray(size)
+        self.numbers = [0] * size
+        self.data = [None] * size
+        self.wheel = TimerWheel(tick)
+        self.highestSent = 0
+        self.highestAnswered = 0
+        self.outstanding = 0
+        self.received = 0
+        self.lost = 0
+        self.duplicates = 0
+        self.late = 0
+        self.reordered = 0
+
+    def slotBusy(self, probeNumber):
+        # The slot is still waiting on an older probe, sending now would push it out of the window
+        slot = probeNumber % self.size
+        return self.states[slot] == OUTSTANDING and self.numbers[slot] != probeNumber
+
+    def unwrap(self, sequence):
+        # Rebuild a 32 bit probe number from the 16 bit ICMP sequence, taking the most recent match
+        probeNumber = (self.highestSent & ~0xffff) | sequence
+        if probeNumber > self.highestSent:
+            probeNumber -= 0x10000
+        return probeNumber
+
+    def probeData(self, probeNumber):
+        # What probeSent was given for this probe, None once the slot holds another one
+        slot = probeNumber % self.size
+        if self.states[slot] == EMPTY or self.numbers[slot] != probeNumber:
+            return None
+        return self.data[slot]
+
+    def probeSent(self, probeNumber, timeSent, data=None):
+        slot = probeNumber % self.size
+        # 1. A probe still outstanding in this slot has fallen out of the window, it counts as lost
+        if self.states[slot] == OUTSTANDING:
+            self.outstanding -= 1
+            self.lost += 1
+        self.states[slot] = OUTSTANDING
+        self.numbers[slot] = probeNumber
+        self.data[slot] = data
+        self.outstanding += 1
+        self.highestSent = probeNumber
+        # 2. Arm its timeout on the wheel
+        self.wheel.schedule(timeSent + self.timeoutNs, probeNumber)
+
+    def replyReceived(self, probeNumber):
+        # Returns (NEW/REORDERED/DUPLICATE/LATE/UNKNOWN, data given to probeSent)
+        slot = probeNumber % self.size
+        if self.numbers[slot] != probeNumber or self.states[slot] == EMPTY:
+            return UNKNOWN, None
+        state = self.states[slot]
+        if state == ANSWERED:
+            self.duplicates += 1
+            return DUPLICATE, self.data[slot]
+        if state == EXPIRED:
+            self.late += 1
+            return LATE, self.data[slot]
+        self.states[slot] = ANSWERED
+        self.outstanding -= 1
+        self.received += 1
+        if probeNumber < self.highestAnswered:
+            self.reordered += 1
+            return REORDERED, self.data[slot]
+        self.highestAnswered = probeNumber
+        return NEW, self.data[slot]
+
+    def expire(self, now):
+        # Returns [(probeNumber, data)] for every probe whose timeout passed without an answer. Every
+        # slot is settled before the list is handed out, so a caller may stop reading half way.
+        expired = []
+        for probeNumber in self.wheel.advance(now):
+            slot = probeNumber % self.size
+            if self.states[slot] == OUTSTANDING and self.numbers[slot] == probeNumber:
+                self.states[slot] = EXPIRED
+                self.outstanding -= 1
+                self.lost += 1
+                expired.append((probeNumber, self.data[slot]))
+        return expired
+
+    def nextExpiry(self, now):
+        # Monotonic time in ns when the next timeout is due, None while nothing is outstanding
+        if not self.outstanding:
+            return None
+        return self.wheel.nextDeadline()
+
+    def details(self):
+        # Keyword arguments for NetworkApplication.printAdditionalDetails
+        return {'duplicates': self.duplicates, 'lateReplies': self.late, 'reordered': self.reordered}
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+import math
+
+# Histogram layout: values are whole microseconds, the first SUB_BUCKETS values get a
+# bucket each, after that every power of two is split into SUB_BUCKETS linear buckets,
+# so a bucket is never wider than 1/32 of its value (about 3% error on a percentile).
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# enough powers of two to cover more than a day in microseconds
+MAX_SHIFT = 32
+BUCKETS = SUB_BUCKETS * (MAX_SHIFT + 2)
+
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+def bucketIndex(microseconds):
+    if microseconds < SUB_BUCKETS:
+        return max(microseconds, 0)
+    shift = microseconds.bit_length() - SUB_BUCKET_BITS - 1
+    if shift > MAX_SHIFT:
+        return BUCKETS - 1
+    return SUB_BUCKETS * (shift + 1) + (microseconds >> shift) - SUB_BUCKETS
+
+
+def bucketMidpoint(index):
+    # Middle of the range of microsecond values that land in this bucket, in milliseconds
+    if index < SUB_BUCKETS:
+        return index / 1000
+    shift = index // SUB_BUCKETS - 1
+    low = (index % SUB_BUCKETS + SUB_BUCKETS) << shift
+    return (low + ((1 << shift) - 1) / 2) / 1000
+
+
+class RTTStatistics:
+    # Constant memory RTT summary fed one result at a time: count and loss,
+    # min/max, Welford running mean and variance, RFC 3550 interarrival jitter
+    # and a log-linear histogram for percentiles. Two accumulators can be merged,
+    # e.g. one per target or per thread into a run total.
+
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.minimumDelay = 0.0
+        self.maximumDelay = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.jitter = 0.0
+        self.lastDelay = None
+        self.histogram = [0] * BUCKETS
+
+    def addDelay(self, delay):
+        # 1. One answered probe, delay in milliseconds
+        self.sent += 1
+        self.received += 1
+        if self.received == 1:
+            self.minimumDelay = self.maximumDelay = delay
+        elif delay < self.minimumDelay:
+            self.minimumDelay = delay
+        elif delay > self.maximumDelay:
+            self.maximumDelay = delay
+        # 2. Welford update of mean and sum of squared differences
+        difference = delay - self.mean
+        self.mean += difference / self.received
+        self.m2 += difference * (delay - self.mean)
+        # 3. RFC 3550 jitter, J += (|D| - J) / 16 with D the change between consecutive RTTs
+        if self.lastDelay is not None:
+            self.jitter += (abs(delay - self.lastDelay) - self.jitter) / 16
+        self.lastDelay = delay
+        # 4. Count it in the histogram
+        self.histogram[bucketIndex(int(delay * 1000))] += 1
+
+    def addLoss(self, lost=1):
+        self.sent += lost
+
+    def merge(self, other):
+        # Chan et al. parallel combination of the two means and variances
+        if other.received:
+            total = self.received + other.received
+            difference = other.mean - self.mean
+            self.m2 += other.m2 + difference * difference * self.received * other.received / total
+            self.mean += difference * other.received / total
+            if not self.received or other.minimumDelay < self.minimumDelay:
+                self.minimumDelay = other.minimumDelay
+            self.maximumDelay = max(self.maximumDelay, other.maximumDelay)
+            # jitter is a per stream quantity, the merged figure weights each stream by its samples
+            self.jitter = (self.jitter * self.received + other.jitter * other.received) / total
+            for index, count in enumerate(other.histogram):
+                if count:
+                    self.histogram[index] += count
+            self.received = total
+        self.sent += other.sent
+        return self
+
+    def packetLoss(self):
+        if not self.sent:
+            return 0.0
+        return (self.sent - self.received) * 100.0 / self.sent
+
+    def standardDeviation(self):
+        if self.received < 2:
+            return 0.0
+        return math.sqrt(self.m2 / (self.received - 1))
+
+    def percentile(self, percent):
+        if not self.received:
+            return 0.0
+        # Smallest bucket holding at least percent of the samples, clamped to the exact extremes
+        wanted = max(math.ceil(self.received * percent / 100), 1)
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            seen += count
+            if seen >= wanted:
+                return min(max(bucketMidpoint(index), self.minimumDelay), self.maximumDelay)
+        return self.maximumDelay
+
+    def details(self):
+        # Keyword arguments for NetworkApplication.printAdditionalDetails
+        return {
+            'packetLoss': self.packetLoss(),
+            'minimumDelay': self.minimumDelay,
+            'averageDelay': self.mean,
+            'maximumDelay': self.maximumDelay,
+            'standardDeviation': self.standardDeviation(),
+            'jitter': self.jitter,
+            'percentiles': [(percent, self.percentile(percent)) for percent in PERCENTILES] if self.received else [],
+        }
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+import random
+import socket
+import struct
+
+IPV4_ADDRESS = struct.Struct("!I")
+# probes per second of a range sweep when no rate is given, so a /16 is not sent back to back
+SWEEP_RATE = 1000
+
+
+def addressToNumber(address):
+    return IPV4_ADDRESS.unpack(socket.inet_aton(address))[0]
+
+
+def numberToAddress(number):
+    return socket.inet_ntoa(IPV4_ADDRESS.pack(number))
+
+
+def isDottedQuad(text):
+    parts = text.split('.')
+    return len(parts) == 4 and all(part.isdigit() and int(part) < 256 for part in parts)
+
+
+def parseTargetRange(text):
+    # (first address, number of addresses) for 10.0.0.0/16, 10.0.0.1-10.0.0.200 or 10.0.0.1-200,
+    # None for anything else (a plain hostname or address)
+    if '/' in text:
+        network, prefix = text.split('/', 1)
+        if not isDottedQuad(network) or not prefix.isdigit() or int(prefix) > 32:
+            raise ValueError('bad CIDR block %s' % (text))
+        prefix = int(prefix)
+        size = 1 << (32 - prefix)
+        first = addressToNumber(network) & ~(size - 1) & 0xffffffff
+        # like fping -g, leave out the network and broadcast addresses of real subnets
+        if prefix <= 30:
+            return first + 1, size - 2
+        return first, size
+    if '-' in text:
+        start, end = text.split('-', 1)
+        if not isDottedQuad(start):
+            return None
+        if end.isdigit():
+            # short form: only the last octet of the end address
+            end = start.rsplit('.', 1)[0] + '.' + end
+        if not isDottedQuad(end):
+            raise ValueError('bad address range %s' % (text))
+        first, last = addressToNumber(start), addressToNumber(end)
+        if last < first:
+            raise ValueError('address range %s runs backwards' % (text))
+        return first, last - first + 1
+    return None
+
+
+def isTargetRange(text):
+    try:
+        return parseTargetRange(text) is not None
+    except ValueError:
+        return True
+
+
+def permutation(count, rng=random):
+    # Every number in range(count) exactly once, in random order, in O(1) memory.
+    # A full period LCG x -> (a * x + c) mod 2^k (a % 4 == 1, c odd) visits every
+    # value below 2^k once; values >= count are skipped, and 2^k < 2 * count so
+    # that costs at most one extra step per number on average.
+    if count <= 0:
+        return
+    modulus = 1 << max(count - 1, 1).bit_length()
+    multiplier = 4 * rng.randrange(1, max(modulus // 4, 2)) + 1
+    increment = rng.randrange(1, modulus, 2)
+    value = rng.randrange(modulus)
+    for step in range(modulus):
+        value = (multiplier * value + increment) % modulus
+        if value < count:
+            yield value
+
+
+def expandTargetRange(text, shuffle=True):
+    # Yields the addresses of a range one at a time, a /8 never exists as a list
+    first, count = parseTargetRange(text)
+    order = permutation(count) if shuffle else range(count)
+    for offset in order:
+        yield numberToAddress(first + offset)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# -*- coding: UTF-8 -*-
+
+######
+# Bit for bit checks of the bulk and incremental checksums against the word by
+# word loop of the original NetworkApplication.checksum. Run from the
+# repository root:
+#
+#   python3 -m unittest discover tests
+import os
+import random
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import icmpChecksum
+import packetBuilder
+
+# fixed seed, a failure shows up again on the next run
+SEED = 20261017
+ROUNDS = 2000
+# probe numbers around the places the 16 bit sequence and the 32 bit probe number wrap
+SEQUENCE_EDGES = (0, 1, 0xfffe, 0xffff, 0x10000, 0x10001, 0x1ffff, 0xfffeffff, 0xfffffffe, 0xffffffff)
+ECHO_REQUEST = 8
+ECHO_REPLY = 0
+
+
+def referenceChecksum(dataToChecksum):
+    # The original checksum, unchanged: two bytes at a time, kept to 32 bits after every word
+    csum = 0
+    countTo = (len(dataToChecksum) // 2) * 2
+    count = 0
+    while count < countTo:
+        thisVal = dataToChecksum[count + 1] * 256 + dataToChecksum[count]
+        csum = csum + thisVal
+        csum = csum & 0xffffffff
+        count = count + 2
+    if countTo < len(dataToChecksum):
+        csum = csum + dataToChecksum[len(dataToChecksum) - 1]
+        csum = csum & 0xffffffff
+    csum = (csum >> 16) + (csum & 0xffff)
+    csum = csum + (csum >> 16)
+    answer = ~csum
+    answer = answer & 0xffff
+    answer = answer >> 8 | (answer << 8 & 0xff00)
+    return socket.htons(answer)
+
+
+class ChecksumTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random = random.Random(SEED)
+
+    def randomBytes(self, length):
+        return bytes(self.random.getrandbits(8) for index in range(length))
+
+    def testRandomLengths(self):
+        # odd and even lengths, short headers up to jumbo frames
+        for round in range(ROUNDS):
+            data = self.randomBytes(self.random.randrange(0, 1600))
+            self.assertEqual(icmpChecksum.checksum(data), referenceChecksum(data), data.hex())
+
+    def testEdgeValues(self):
+        # sums that land on 0 and on multiples of 0xffff, where the end around carry matters
+        for length in range(0, 40):
+            for data in (bytes(length), b'\xff' * length, b'\x00\xff' * (length // 2), b'\xff\x00' * (length // 2)):
+                self.assertEqual(icmpChecksum.checksum(data), referenceChecksum(data), data.hex())
+
+    def testViewsAndBuffers(self):
+        data = self.randomBytes(101)
+        for value in (bytearray(data), memoryview(data), memoryview(bytearray(data))[1:]):
+            self.assertEqual(icmpChecksum.checksum(value), referenceChecksum(bytes(value)))
+
+    def testBeyondExactSum(self):
+        # past EXACT_SUM_LIMIT the original's 32 bit sum wraps, the bulk path has to wrap with it
+        for length in (icmpChecksum.EXACT_SUM_LIMIT - 1, icmpChecksum.EXACT_SUM_LIMIT + 1, 3 * 65537):
+            data = b'\xff' * length
+            self.assertEqual(icmpChecksum.checksum(data), referenceChecksum(data), length)
+        data = self.randomBytes(icmpChecksum.EXACT_SUM_LIMIT + 3)
+        self.assertEqual(icmpChecksum.checksum(data), referenceChecksum(data))
+
+    def testBatch(self):
+        # the numpy pass when numpy is there, packet by packet otherwise
+        for length in (1, 2, 35, 36, 64, 577):
+            packets = [self.randomBytes(length) for index in range(17)] + [bytes(length), b'\xff' * length]
+            self.assertEqual(icmpChecksum.checksumBatch(packets), [referenceChecksum(packet) for packet in packets])
+
+
+class EchoTemplateTest(unittest.TestCase):
+    # RFC 1624 incremental update against a full checksum of the packet it built
+
+    def setUp(self):
+        self.random = random.Random(SEED)
+
+    def assertChecksummed(self, packet):
+        header = bytearray(packet)
+        field = packetBuilder.CHECKSUM_FIELD.unpack_from(header, 2)[0]
+        packetBuilder.CHECKSUM_FIELD.pack_into(header, 2, 0)
+        # the reference result goes into a header through socket.htons, as the original built probes
+        self.assertEqual(field, socket.htons(referenceChecksum(header)), bytes(packet).hex())
+        # a correct checksum makes the whole packet sum to zero
+        self.assertEqual(referenceChecksum(bytes(packet)), 0, bytes(packet).hex())
+
+    def testRandomProbes(self):
+        for round in range(ROUNDS):
+            template = packetBuilder.EchoTemplate(self.random.choice((ECHO_REQUEST, ECHO_REPLY)),
+                                                  self.random.getrandbits(16))
+            sequence = self.random.getrandbits(32)
+            timeSent = self.random.getrandbits(64)
+            target = self.random.getrandbits(32)
+            padding = self.random.choice((0, 1, 28, 29, 1436))
+            self.assertChecksummed(template.build(sequence, timeSent, target, padding))
+
+    def testSequenceWrap(self):
+        for identifier in (0, 1, 0xffff):
+            template = packetBuilder.EchoTemplate(ECHO_REQUEST, identifier)
+            for sequence in SEQUENCE_EDGES:
+                for timeSent in (0, 0xffff, (1 << 64) - 1, self.random.getrandbits(64)):
+                    for target in (0, 0xffff, 0xffffffff):
+                        self.assertChecksummed(template.build(sequence, timeSent, target))
+
+    def testPackInto(self):
+        template = packetBuilder.EchoTemplate(ECHO_REQUEST, 0x1234)
+        buffer = bytearray(3 + packetBuilder.ECHO_PACKET.size)
+        for sequence in SEQUENCE_EDGES:
+            template.packInto(buffer, 3, sequence, self.random.getrandbits(64))
+            self.assertChecksummed(buffer[3:])
+
+
+if __name__ == '__main__':
+    unittest.main()